@@ -0,0 +1,82 @@
+import argparse
+import platform
+import shutil
+import sys
+import tempfile
+
+from bench.generate import generate_site, TEMPLATES
+from bench.run import run_benchmarks, flatten, find_regressions, load_results, save_results
+
+def parse_mix(value):
+    parts = [float(x) for x in value.split(':')]
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError('mix should be md:txt:html weights, e.g. 70:20:10')
+    return tuple(parts)
+
+#Create parser
+parser = argparse.ArgumentParser(
+    prog = 'python -m bench',
+    description = 'Generate a synthetic site and time the S4 build pipeline on it.'
+)
+
+#Site shape
+parser.add_argument('--pages', type=int, default=1000, help='Number of pages (e.g. 1000, 10000, 100000).')
+parser.add_argument('--depth', type=int, default=3, help='Depth of the directory tree.')
+parser.add_argument('--fanout', type=int, default=4, help='Subdirectories per directory.')
+parser.add_argument('--mix', type=parse_mix, default=(70, 20, 10), help='Weights of md:txt:html pages.')
+parser.add_argument('--assets', type=int, default=20, help='Number of assets.')
+parser.add_argument('--asset-size', type=int, default=50000, help='Size of each asset in bytes.')
+parser.add_argument('--template', choices=list(TEMPLATES), default='nav', help='Page template complexity.')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the generated content.')
+parser.add_argument('--text-size', type=int, default=5000000, help='Size in characters of a large plain-text document to time converting (0 skips it).')
+
+#Run options
+parser.add_argument('--repeat', type=int, default=1, help='Runs per measurement; the best is kept.')
+parser.add_argument('--dir', help='Where to generate the site (defaults to a temporary directory that is removed afterwards).')
+parser.add_argument('-o', '--output', help='Write the results as JSON to this path.')
+parser.add_argument('-b', '--baseline', help='Compare against results saved with --output, and exit non-zero on regressions.')
+parser.add_argument('-t', '--threshold', type=float, default=0.1, help='Allowed slowdown before a metric counts as a regression (0.1 = 10%%).')
+
+def main():
+    args = parser.parse_args()
+
+    params = {
+        'pages': args.pages,
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'mix': list(args.mix),
+        'assets': args.assets,
+        'asset_size': args.asset_size,
+        'template': args.template,
+        'seed': args.seed,
+        'text_size': args.text_size
+    }
+
+    site_dir = args.dir or tempfile.mkdtemp(prefix='s4-bench-')
+    try:
+        conf_path = generate_site(site_dir, args.pages, args.depth, args.fanout, args.mix, args.assets, args.asset_size, args.template, args.seed)
+        metrics = run_benchmarks(conf_path, args.repeat, args.text_size)
+    finally:
+        if not args.dir:
+            shutil.rmtree(site_dir, ignore_errors=True)
+
+    results = {'params': params, 'python': platform.python_version(), 'metrics': metrics}
+
+    for key, value in flatten(metrics).items():
+        print(f'{key:<32} {value:>14.4f}' if isinstance(value, float) else f'{key:<32} {value:>14}')
+
+    if args.output:
+        save_results(args.output, results)
+
+    if args.baseline:
+        baseline = load_results(args.baseline)
+        if baseline['params'] != params:
+            print('WARNING: Baseline was recorded with different parameters.')
+        regressions = find_regressions(metrics, baseline['metrics'], args.threshold)
+        for key, base, value in regressions:
+            print(f'REGRESSION: {key} went from {base:.4f} to {value:.4f}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import random
+import shutil
+from pathlib import Path
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed luctus non velit eu porttitor nulla facilisi '
+         'donec malesuada iaculis augue quis imperdiet dictum vel pulvinar neque congue eget posuere orci lobortis').split()
+
+TEMPLATES = {
+    'simple': None,
+    'nav': """<!DOCTYPE html>
+<html>
+    <head><title>{{ title }}</title>{% for x in stylesheets %}<link rel="stylesheet" href="/{{ x }}">{% endfor %}</head>
+    <body>
+        <nav>{% for page in root_pages %}<a href="/{{ page.url }}">{{ page.title }}</a>{% endfor %}</nav>
+        <ul>{% for page in subpages %}<li><a href="/{{ page.url }}">{{ page.title }}</a></li>{% endfor %}</ul>
+        <main>{{ html_content }}</main>
+    </body>
+</html>""",
+    'heavy': """<!DOCTYPE html>
+<html>
+    <head><title>{{ title }} - {{ website_title }}</title>{% for x in stylesheets %}<link rel="stylesheet" href="/{{ x }}">{% endfor %}</head>
+    <body>
+        {% macro tree(url, depth) %}{% if depth > 0 %}<ul>{% for page in children(url) %}<li><a href="/{{ page.url }}">{{ page.title | title }}</a>{{ tree(page.url, depth - 1) }}</li>{% endfor %}</ul>{% endif %}{% endmacro %}
+        <nav>{% for page in root_pages %}<a href="/{{ page.url }}">{{ page.title }}</a>{{ tree(page.url, 2) }}{% endfor %}</nav>
+        {% set up = parent(url) %}{% if up %}<a href="/{{ up.url }}">Up: {{ up.title }}</a>{% endif %}
+        <ul>{% for page in subpages | sort(attribute='title') %}<li><a href="/{{ page.url }}">{{ page.title | upper }}</a></li>{% endfor %}</ul>
+        <main>{{ html_content }}</main>
+        <footer>{{ pages | length }} pages</footer>
+    </body>
+</html>"""
+}
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+def _paragraphs(rng, n):
+    return [' '.join(_sentence(rng, rng.randint(6, 16)) for _ in range(rng.randint(2, 6))) for _ in range(n)]
+
+def _markdown(rng, title):
+    lines = [f'# {title}', '']
+    for i, para in enumerate(_paragraphs(rng, rng.randint(3, 8))):
+        if i % 3 == 1:
+            lines += [f'## {_sentence(rng, 3)}', '']
+        lines += [para, '']
+        if i % 4 == 2:
+            lines += [f'- {_sentence(rng, 4)}' for _ in range(rng.randint(2, 5))] + ['']
+        if i % 5 == 3:
+            lines += [f'See [{rng.choice(WORDS)}](https://example.com/{rng.choice(WORDS)}) and `{rng.choice(WORDS)}()`.', '']
+    return '\n'.join(lines)
+
+def _text(rng):
+    paras = _paragraphs(rng, rng.randint(3, 8))
+    paras = [x + f' https://example.com/{rng.choice(WORDS)}/{i} ' + _sentence(rng, 5) if i % 2 else x for i, x in enumerate(paras)]
+    return '\n\n'.join(paras) + '\n'
+
+# A single large plain-text document of about size characters, like a log or an RFC
+def generate_text(size, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = _text(rng)
+        parts.append(part)
+        length += len(part) + 1
+    return '\n'.join(parts)
+
+def _html(rng, title):
+    body = ''.join(f'<p>{x}</p>\n' for x in _paragraphs(rng, rng.randint(3, 8)))
+    return f'<h1>{title}</h1>\n{body}'
+
+def _stylesheet(rng, size):
+    rules = []
+    length = 0
+    while length < size:
+        rule = f'/* {_sentence(rng, 4)} */\n.{rng.choice(WORDS)}-{len(rules)} {{\n    margin: {rng.randint(0, 4)}em;\n    color: #{rng.randrange(16 ** 6):06x};\n}}\n'
+        rules.append(rule)
+        length += len(rule)
+    return ''.join(rules)
+
+def _directories(depth, fanout):
+    dirs = [Path('.')]
+    level = [Path('.')]
+    for d in range(depth):
+        level = [x / f'section-{d}-{i}' for x in level for i in range(fanout)]
+        dirs += level
+    return dirs
+
+# Write a deterministic synthetic site to path and return its config file
+def generate_site(path, pages=1000, depth=3, fanout=4, mix=(0.7, 0.2, 0.1), assets=20, asset_size=50000, template='nav', seed=0):
+    rng = random.Random(seed)
+    path = Path(path).resolve()
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+
+    dirs = _directories(depth, fanout)
+    kinds = rng.choices(['md', 'txt', 'html'], weights=mix, k=pages)
+    for i, kind in enumerate(kinds):
+        folder = path / dirs[i % len(dirs)]
+        folder.mkdir(parents=True, exist_ok=True)
+        title = f'{_sentence(rng, 2)[:-1]} {i}'
+        name = title.lower().replace(' ', '-')
+        if kind == 'md':
+            content = _markdown(rng, title)
+        elif kind == 'txt':
+            content = _text(rng)
+        else:
+            content = _html(rng, title)
+        with open(folder / f'{name}.{kind}', 'w') as f:
+            f.write(content)
+
+    for i in range(assets):
+        folder = path / 'static' / dirs[i % len(dirs)]
+        folder.mkdir(parents=True, exist_ok=True)
+        if i % 5 == 0:
+            with open(folder / f'asset-{i}.css', 'w') as f:
+                f.write(_stylesheet(rng, asset_size))
+        else:
+            with open(folder / f'asset-{i}.png', 'wb') as f:
+                f.write(rng.randbytes(asset_size))
+
+    conf = [f'source = "{path.as_posix()}"', f'output = "{(path / "output").as_posix()}"', f'cache = "{(path / ".s4-cache").as_posix()}"']
+    if TEMPLATES[template]:
+        with open(path / '.template.html', 'w') as f:
+            f.write(TEMPLATES[template])
+        conf.append(f'template = "{(path / ".template.html").as_posix()}"')
+    conf_path = path / 's4.toml'
+    with open(conf_path, 'w') as f:
+        f.write('\n'.join(conf) + '\n')
+    return conf_path
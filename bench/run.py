@@ -0,0 +1,157 @@
+import http.server
+import json
+import multiprocessing
+import shutil
+import threading
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from bench.startup import measure_startup
+
+# Differences smaller than these are treated as noise when comparing against a baseline
+MIN_TIME_DELTA = 0.01
+MIN_RSS_DELTA = 1024 * 1024
+
+def _reset(conf_path):
+    site_dir = Path(conf_path).parent
+    shutil.rmtree(site_dir / 'output', ignore_errors=True)
+    shutil.rmtree(site_dir / '.s4-cache', ignore_errors=True)
+
+def measure_build(conf_path):
+    from s4_gen import Site
+    from s4_gen.profile import peak_rss
+
+    _reset(conf_path)
+    steps = {}
+
+    def hook(record):
+        if record['artifact'] is None:
+            steps[record['step']] = steps.get(record['step'], 0) + record['wall']
+
+    start = time.perf_counter()
+    site = Site()
+    site.load(conf_path)
+    load = time.perf_counter() - start
+
+    site.add_timing_hook(hook)
+    start = time.perf_counter()
+    site.build(full=True)
+    build_full = time.perf_counter() - start
+    site.timing_hooks.remove(hook)
+
+    start = time.perf_counter()
+    site.build()
+    build_noop = time.perf_counter() - start
+
+    return {
+        'load': load,
+        'build_full': build_full,
+        'build_noop': build_noop,
+        'steps': steps,
+        'peak_rss_build': peak_rss()
+    }
+
+# A full streaming build on its own, since peak memory can only be told apart in a separate process
+def measure_stream_build(conf_path):
+    from s4_gen import Site
+    from s4_gen.profile import peak_rss
+
+    _reset(conf_path)
+    site = Site()
+    site.load(conf_path)
+    start = time.perf_counter()
+    site.build(full=True, stream=True)
+
+    return {
+        'build_stream': time.perf_counter() - start,
+        'peak_rss_stream': peak_rss()
+    }
+
+# Time from loading the site to the first byte of the home page from the in-memory dev server
+def measure_serve(conf_path):
+    from s4_gen import Site
+    from s4_gen.server import DevServer
+    from s4_gen.profile import peak_rss
+
+    _reset(conf_path)
+    start = time.perf_counter()
+    site = Site()
+    site.load(conf_path)
+    dev = DevServer(site)
+    dev.prepare()
+    server = http.server.ThreadingHTTPServer(('localhost', 0), dev.make_handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with urllib.request.urlopen(f'http://localhost:{server.server_address[1]}/') as response:
+        response.read(1)
+    first_byte = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        'serve_first_byte': first_byte,
+        'peak_rss_serve': peak_rss()
+    }
+
+# Convert one large plain-text document, bypassing the conversion cache
+def measure_convert(text_size, seed=0):
+    from bench.generate import generate_text
+    from s4_gen.convert import convert
+
+    text = generate_text(text_size, seed)
+    start = time.perf_counter()
+    convert(text, '.txt', '.html')
+    return {'txt2html_large': time.perf_counter() - start}
+
+# Run a measurement in a fresh interpreter, so imports, caches and peak memory don't carry over between runs
+def run_isolated(func, *args):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(func, *args).result()
+
+def _best(runs):
+    best = {}
+    for run in runs:
+        for key, value in run.items():
+            if isinstance(value, dict):
+                best[key] = _best([best.get(key, value), value])
+            else:
+                best[key] = min(best.get(key, value), value)
+    return best
+
+def run_benchmarks(conf_path, repeat=1, text_size=0):
+    metrics = _best([measure_startup() for _ in range(repeat)])
+    for func in [measure_build, measure_stream_build, measure_serve]:
+        metrics.update(_best([run_isolated(func, conf_path) for _ in range(repeat)]))
+    if text_size:
+        metrics.update(_best([run_isolated(measure_convert, text_size) for _ in range(repeat)]))
+    return metrics
+
+def flatten(metrics, prefix=''):
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+# Metrics that got worse than the baseline by more than threshold (a fraction), as (name, baseline, value) tuples
+def find_regressions(metrics, baseline, threshold):
+    regressions = []
+    baseline = flatten(baseline)
+    for key, value in flatten(metrics).items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        floor = MIN_RSS_DELTA if key.startswith('peak_rss') else MIN_TIME_DELTA
+        if value > base * (1 + threshold) and value - base > floor:
+            regressions.append((key, base, value))
+    return regressions
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_results(path, results):
+    with open(path, 'w+') as f:
+        json.dump(results, f, indent=1)
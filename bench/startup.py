@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+# Modules that only some commands need. None of them should be imported just to start the CLI.
+HEAVY_MODULES = ['jinja2', 'mistletoe', 'http.server', 'webbrowser', 'multiprocessing', 'concurrent.futures']
+
+# Parse the stderr of `python -X importtime` into {module: (self seconds, cumulative seconds)}
+def parse_importtime(output):
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        modules[parts[2].strip()] = (int(parts[0]) / 1e6, int(parts[1]) / 1e6)
+    return modules
+
+# Start the CLI with `-X importtime` and report how long its imports take
+def measure_startup(args=('--help',)):
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([str(SRC), os.environ.get('PYTHONPATH', '')])}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', str(SRC / 'cli' / 'cli.py'), *args],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    wall = time.perf_counter() - start
+    modules = parse_importtime(result.stderr)
+
+    return {
+        'startup_wall': wall,
+        'startup_imports': sum(x[0] for x in modules.values()),
+        'startup_s4_gen': sum(x[0] for name, x in modules.items() if name.split('.')[0] in ('s4_gen', 'cli')),
+        'startup_heavy_modules': sum(1 for name in HEAVY_MODULES if name in modules)
+    }
@@ -1,50 +1,149 @@
 import argparse
-from s4_gen import Site, Config
+import sys
+from pathlib import Path
+from s4_gen.site import Site
+from s4_gen.shard import parse_shard
+
+def print_report(report):
+    print(f"Built {report['built']} of {report['artifacts']} artifacts. Copied {report['bytes_copied']} bytes of assets, skipped {report['bytes_skipped']} unchanged.")
+    changes = report['changes']
+    print(f"Output files: {changes['added']} added, {changes['modified']} modified, {changes['deleted']} deleted.")
 
 def build(args):
 
+    site = Site()
+    site.load_config(args.config)
+
+    #Hand the build to the site's daemon if one is running, unless it needs options only an in-process build has
+    if not (args.no_daemon or args.profile or args.shard or args.metadata):
+        from s4_gen.daemon import request_build
+        response = request_build(site.config, {
+            'full': args.full,
+            'jobs': args.jobs,
+            'stream': args.stream,
+            'clean': args.clean,
+            'changes': str(Path(args.changes).resolve()) if args.changes else None,
+            'publish': str(Path(args.publish).absolute()) if args.publish else None
+        }, timeout=args.daemon_timeout or None)
+        if response is not None and 'report' in response:
+            print_report(response['report'])
+            return
+        if response is not None and not response.get('fallback'):
+            print(f"ERROR: {response['error']}")
+            sys.exit(1)
+        if response is not None:
+            print(f"WARNING: {response['error']} Building without it.")
+
+    site.reload()
+
+    #If specified, record how long every step takes
+    profiler = None
+    if args.profile:
+        from s4_gen.profile import Profiler
+        profiler = Profiler()
+        site.add_timing_hook(profiler)
+
+    #Hold the site's build lock throughout, so a build daemon or another build can't write the same output meanwhile
+    try:
+        with site.config.get_build_lock():
+
+            #If specified, remove old output directory
+            if args.clean:
+                site.clean()
+
+            #Build site, only rebuilding changed artifacts unless a full build is requested
+            site.build(full=args.full, jobs=args.jobs, stream=args.stream, shard=args.shard, metadata=args.metadata, changes=args.changes)
+
+            if profiler:
+                profiler.write_trace(args.profile)
+                print(profiler.table())
+            print_report(site.report)
+
+            #If specified, swap the new output in at the publish path
+            if args.publish:
+                site.publish(args.publish)
+    except ValueError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+def serve(args):
+
     site = Site()
 
     if args.config:
         site.load(args.config)
     else:
         site.load()
-        
+
     #If specified, remove old output directory
     if args.clean:
         site.clean()
 
-    #Build site
-    site.build()
+    #Build and serve site locally, or render pages in memory as they are requested
+    if not args.memory:
+        site.build(jobs=args.jobs)
+    site.serve(watch=args.watch, memory=args.memory)
 
-def serve(args):
+def daemon(args):
 
+    #The source files are discovered by the first build request
     site = Site()
+    site.load_config(args.config)
 
-    if args.config:
-        site.load(args.config)
-    else:
-        site.load()
+    #Keep the site loaded and build it whenever the build command asks, until interrupted
+    from s4_gen.daemon import BuildDaemon
+    try:
+        BuildDaemon(site).serve_forever()
+    except KeyboardInterrupt:
+        pass
 
-    #If specified, remove old output directory
-    if args.clean:
+def clean(args):
+
+    #Only the config is needed to find the output directory, so don't walk the source tree
+    site = Site()
+    site.load_config(args.config)
+
+    #Remove old output directory, unless a build is writing it
+    try:
         site.clean()
+    except ValueError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
 
-    #Build and serve site locally
-    site.build()
-    site.serve()
+def merge(args):
 
-def clean(args):
+    site = Site()
+    site.load_config(args.config)
+
+    #Combine the outputs of a sharded build and write the home redirect, first removing the old output directory if specified
+    try:
+        with site.config.get_build_lock():
+            if args.clean:
+                site.clean()
+            site.merge(args.dirs)
+    except ValueError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+def shard(value):
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def cache(args):
 
     site = Site()
+    site.load_config(args.config)
+    conversions = site.config.get_conversion_cache()
 
-    if args.config:
-        site.load(args.config)
-    else:
-        site.load()
-    
-    #Remove old output directory
-    site.clean()
+    if args.action == 'stats':
+        stats = conversions.stats()
+        print(f"Conversion cache: {stats['entries']} entries, {stats['size']} of {stats['max_size']} bytes.")
+    elif args.action == 'prune':
+        print(f'Removed {conversions.prune()} entries from the conversion cache.')
+    elif args.action == 'clear':
+        conversions.clear()
 
 #Create parser
 parser = argparse.ArgumentParser(
@@ -61,15 +160,42 @@ parser.add_argument('-r', '--clean', action='store_true', help='Delete output di
 #Create parser for build subcommand
 build_parser = subparsers.add_parser('build')
 build_parser.set_defaults(func=build)
+build_parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes to build pages with (0 uses every core).')
+build_parser.add_argument('--profile', metavar='PATH', help='Write per-step timings to PATH as a Chrome trace and print the slowest artifacts.')
+build_parser.add_argument('--full', action='store_true', help='Ignore the build manifest and rebuild every artifact.')
+build_parser.add_argument('--shard', metavar='K/N', type=shard, help='Only build the pages assigned to shard K of N, for combining with merge.')
+build_parser.add_argument('--metadata', metavar='PATH', help='Site metadata file every shard builds from. Written if it does not exist (defaults to the cache directory).')
+build_parser.add_argument('--changes', metavar='PATH', help='Where to write the list of added, modified and deleted output files (defaults to changes.json in the cache directory).')
+build_parser.add_argument('--publish', metavar='PATH', help='After building, atomically point PATH (a symlink) at a hardlinked snapshot of the output.')
+build_parser.add_argument('-s', '--stream', action='store_true', help='Build one artifact at a time and release its content once written, to keep memory use low on large sites.')
+build_parser.add_argument('--no-daemon', action='store_true', help='Build in this process even if a build daemon is running for the site.')
+build_parser.add_argument('--daemon-timeout', metavar='SECONDS', type=float, default=600, help='Build in this process if the daemon has not finished the build after SECONDS (0 waits forever, default 600).')
 
 #Create parser for serve subcommand
 serve_parser = subparsers.add_parser('serve')
 serve_parser.set_defaults(func=serve)
+serve_parser.add_argument('-w', '--watch', action='store_true', help='Rebuild changed files and reload open pages while serving.')
+serve_parser.add_argument('-m', '--memory', action='store_true', help='Serve pages from memory, rendering each one when it is first requested, instead of building the site first.')
+serve_parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes to build pages with (0 uses every core).')
+
+#Create parser for daemon subcommand
+daemon_parser = subparsers.add_parser('daemon')
+daemon_parser.set_defaults(func=daemon)
 
 #Create parser for clean subcommand
 clean_parser = subparsers.add_parser('clean')
 clean_parser.set_defaults(func=clean)
 
+#Create parser for merge subcommand
+merge_parser = subparsers.add_parser('merge')
+merge_parser.set_defaults(func=merge)
+merge_parser.add_argument('dirs', nargs='+', metavar='DIR', help='Output directories of the shards of a sharded build.')
+
+#Create parser for cache subcommand
+cache_parser = subparsers.add_parser('cache')
+cache_parser.set_defaults(func=cache)
+cache_parser.add_argument('action', choices=['stats', 'prune', 'clear'], help='Show the size of, shrink to the size cap, or empty the conversion cache.')
+
 #Run argument parser
 def run():
     args = parser.parse_args()
@@ -1,6 +1,9 @@
-from s4_gen.site import Site
-from s4_gen.config import Config
-import s4_gen.config
-import s4_gen.site
-import s4_gen.artifact
-import s4_gen.utils
+# Site and Config are imported on first use, so commands that don't build anything start quickly
+def __getattr__(name):
+    if name == 'Site':
+        from s4_gen.site import Site
+        return Site
+    if name == 'Config':
+        from s4_gen.config import Config
+        return Config
+    raise AttributeError(f"module 's4_gen' has no attribute '{name}'")
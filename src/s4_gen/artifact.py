@@ -1,19 +1,67 @@
-import shutil
+import os
+from collections import ChainMap
+from collections.abc import Mapping
+from math import ceil
 from pathlib import Path
 from urllib.parse import quote
 
-import mistletoe
-from jinja2 import Template
+from s4_gen.convert import convert
+from s4_gen.sync import sync_file
+from s4_gen.minify import minify, MINIFY_VERSION
+from s4_gen.utils import prettify_path, filename_to_title, hash_text, hash_file, AtomicFile
 
-from s4_gen.utils import prettify_path, filename_to_title
+# Hex digits of the content hash put in the names of fingerprinted assets
+HASHED_NAME_LENGTH = 12
+
+# Site-wide context entries that list the site's pages, so what they render changes when pages are added, removed or renamed
+LISTING_KEYS = {'pages', 'root_pages', 'children', 'parent', 'index', 'artifacts'}
+
+# The site-wide context as an artifact's templates see it. Templates look up each variable they use when they run, so
+# a lookup of one of the listing entries marks the artifact as depending on the page listing.
+class RecordingContext(Mapping):
+
+    def __init__(self, artifact, context):
+        self.artifact = artifact
+        self.context = context
+
+    def __getitem__(self, key):
+        value = self.context[key]
+        if key in LISTING_KEYS:
+            self.artifact['reads_listing'] = True
+        return value
+
+    def __iter__(self):
+        return iter(self.context)
+
+    def __len__(self):
+        return len(self.context)
 
 class Artifact(dict):
 
+    # Steps that only wait on I/O, which the site runs for these artifacts on a thread pool
+    threaded_steps = []
+
+    # Fields holding content rather than metadata, dropped by release() once the artifact is written
+    heavy_fields = []
+
+    # Artifacts are listed in the directory index (pages, subpages, ...) unless they are only extra output of another one
+    listed = True
+
+    # The artifact this one was split off from by expand(), if any
+    origin = None
+
+    # With fingerprint_assets on, whether the output file is named after a hash of the source
+    hashed_name = False
+
     def __init__(self, path, config, context):
         self.src = Path(path)
         self.dest = None
         self.config = config
         self.global_context = context
+        # What templates see: this artifact's fields over the site-wide context. A live view, so it is built once.
+        self.render_context = ChainMap(self, RecordingContext(self, context))
+        # Hash of the output of the last build, from the manifest, so unchanged output isn't rewritten
+        self.last_output = None
 
     @staticmethod
     def is_supported(path):
@@ -22,8 +70,38 @@ class Artifact(dict):
     def setup_context(self):
         self['src'] = self.src.as_posix()
 
+    # The bytes this artifact writes to its dest, for serving it without writing it
+    def get_output(self):
+        with open(self.src, 'rb') as f:
+            return f.read()
+
+    # Inputs that determine this artifact's output, compared against the build manifest
+    def fingerprint(self):
+        return {
+            'type': type(self).__name__,
+            'source': self.source_signature(),
+            'config': {
+                'source': self.config['source'].as_posix(),
+                'output': self.config['output'].as_posix(),
+                'prettify_urls': self.config['prettify_urls']
+            }
+        }
+
+    def source_signature(self):
+        return hash_file(self.src) if self.src.is_file() else None
+
+    # Extra artifacts this one splits into, called once the directory index is built
+    def expand(self):
+        return []
+
+    def release(self):
+        for key in self.heavy_fields:
+            self.pop(key, None)
+
 class Page(Artifact):
 
+    heavy_fields = ['raw_content', 'raw_html_content', 'html_content', 'html']
+
     def __init__(self, path, config, context):
         super().__init__(path, config, context)
         self.template = None
@@ -37,15 +115,18 @@ class Page(Artifact):
 
         self.template = self.config['template']
 
-        dest = self.src
+        dest = self.src.relative_to(self.config['source'])
         if self.config['prettify_urls']:
             dest = prettify_path(dest)
-        dest = dest.with_suffix('')
-        if dest.name != 'index':
-            dest = dest / 'index.html'
+        if dest.name == '':
+            dest = Path('index.html')
         else:
-            dest = dest.with_suffix('.html')
-        self.dest = self.config['output'] / dest.relative_to(self.config['source'])
+            dest = dest.with_suffix('')
+            if dest.name != 'index':
+                dest = dest / 'index.html'
+            else:
+                dest = dest.with_suffix('.html')
+        self.dest = self.config['output'] / dest
         
         self['dest'] = self.dest.as_posix()
 
@@ -53,40 +134,117 @@ class Page(Artifact):
 
         self['url'] = quote(self.dest.relative_to(self.config['output']).as_posix())
 
+    def build_context(self):
+        self['subpages'] = self.global_context['index'].siblings(self.dest)
+
+    def fingerprint(self):
+        inputs = super().fingerprint()
+        inputs['template'] = getattr(self.template, 'digest', None)
+        inputs['subpages'] = [[x['url'], x['title']] for x in self['subpages']]
+        return inputs
+
+    # Directories (nav pages) have no content of their own. Any other read error fails the build rather than leaving the page blank.
+    def read_content(self):
         try:
             with open(self.src, 'r') as f:
                 self['raw_content'] = f.read()
-        except:
+        except IsADirectoryError:
             self['raw_content'] = ''
 
-    def build_context(self):
-        self['subpages'] = [x for x in self.global_context['artifacts'] if x.dest.parent == self.dest.parent and x.dest != self.dest and x.dest.suffix == '.html']
-
     def convert_content(self):
         self['raw_html_content'] = self['raw_content']
 
+    # Record the terms of the page's rendered body for the search index, which the site merges once every page is indexed
+    def index_content(self):
+        if self.config['search_index']:
+            self.config.get_search_index().add_page(self['src'], self['html_content'])
+
     def render_content(self):
-        self['html_content'] = Template(self['raw_html_content']).render(**self.global_context, **self)
+        self['reads_listing'] = False
+        templates = self.config.get_templates()
+        self['html_content'] = templates.render(templates.from_string(self['raw_html_content'], bytecode=False), self.render_context)
 
     def render_artifact(self):
-        self['html'] = self.template.render(**self.global_context, **self)
+        self['html'] = self.config.get_templates().render(self.template, self.render_context)
 
-    def write_artifact(self):
-        self.dest.parent.mkdir(exist_ok=True, parents=True)
-        with open(self['dest'], 'w+') as f:
-            f.write(self['html'])
+    def get_output(self):
+        return self['html'].encode('utf-8')
 
+    # Pages that weren't rendered in memory are rendered chunk by chunk into the file, without building the whole document
+    def write_artifact(self):
+        self.config.get_output_dirs().make(self.dest.parent)
+        writer = AtomicFile(self.dest, self.last_output)
+        with writer as f:
+            if 'html' in self:
+                f.write(self['html'])
+            else:
+                self.config.get_templates().stream(self.template, self.render_context).dump(f)
+        self['output_hash'] = writer.digest
+
+# Lists the pages one directory below it. With nav_page_size set, the list is split over page/2/index.html,
+# page/3/index.html, ... next to the first page, each an artifact of its own that renders only its slice of the list.
 class NavPage(Page):
-    def __init__(self, path, config, context):
+    def __init__(self, path, config, context, origin=None, number=1):
         super().__init__(path, config, context)
+        self.origin = origin
+        self.listed = origin is None
+        self.number = number
+        self.children = []
+        self.page_count = 1
 
     @staticmethod
     def is_supported(path):
         return Path(path).is_dir()
 
     def setup_context(self):
-        super().setup_context()
-        self.template = self.config['nav_template']
+        if self.origin is None:
+            super().setup_context()
+            self.template = self.config['nav_template']
+            return
+        Artifact.setup_context(self)
+        self.template = self.origin.template
+        self.dest = self.origin.dest.parent / 'page' / str(self.number) / 'index.html'
+        self['dest'] = self.dest.as_posix()
+        self['title'] = self.origin['title']
+        self['url'] = quote(self.dest.relative_to(self.config['output']).as_posix())
+
+    def expand(self):
+        if self.origin is not None:
+            return []
+        self.children = list(self.global_context['index'].children(self['url']))
+        key = self.config['nav_sort']
+        if key:
+            self.children.sort(key=lambda x: x.get(key.lstrip('-')) or '', reverse=key.startswith('-'))
+        size = self.config['nav_page_size']
+        self.page_count = max(1, ceil(len(self.children) / size)) if size > 0 else 1
+        return [NavPage(self.src / 'page' / str(x), self.config, self.global_context, self, x) for x in range(2, self.page_count + 1)]
+
+    def page_url(self, number):
+        if number == 1:
+            return self['url']
+        return quote((self.dest.parent / 'page' / str(number) / 'index.html').relative_to(self.config['output']).as_posix())
+
+    def build_context(self):
+        super().build_context()
+        nav = self.origin or self
+        size = self.config['nav_page_size']
+        start = (self.number - 1) * size if size > 0 else 0
+        self['items'] = nav.children[start:start + size] if size > 0 else nav.children
+        self['total'] = len(nav.children)
+        self['page_number'] = self.number
+        self['page_count'] = nav.page_count
+        self['prev_url'] = nav.page_url(self.number - 1) if self.number > 1 else None
+        self['next_url'] = nav.page_url(self.number + 1) if self.number < nav.page_count else None
+
+    def fingerprint(self):
+        inputs = super().fingerprint()
+        inputs['items'] = [[x['url'], x['title']] for x in self['items']]
+        inputs['pagination'] = [self['page_number'], self['page_count'], self['prev_url'], self['next_url']]
+        return inputs
+
+    # Directories have no text of their own to search
+    def index_content(self):
+        pass
 
 class HtmlPage(Page):
     def __init__(self, path, config, context):
@@ -105,16 +263,7 @@ class PlainTextPage(Page):
         return Path(path).suffix == '.txt'
 
     def convert_content(self):
-        _html_text = self['raw_content']
-
-        urls = re.findall('https?://.*\\W', _html_text)
-        for url in urls:
-            _html_text = _html_text.replace(url, f'<a href="{url}">{url}</a>')
-        
-        para = [x for x in _html_text.split('\n\n') if not x.isspace()]
-        _html_text = '<p>\n' + '\n</p>\n<p>\n'.join(para) + '\n</p>'
-
-        self['raw_html_content'] = _html_text
+        self['raw_html_content'] = convert(self['raw_content'], '.txt', '.html', self.config.get_conversion_cache())
 
 class MarkdownPage(Page):
     def __init__(self, path, config, context):
@@ -125,34 +274,60 @@ class MarkdownPage(Page):
         return Path(path).suffix == '.md'
 
     def convert_content(self):
-        self['raw_html_content'] = mistletoe.markdown(self['raw_content'])
+        self['raw_html_content'] = convert(self['raw_content'], '.md', '.html', self.config.get_conversion_cache())
 
 class Asset(Artifact):
 
+    threaded_steps = ['write_artifact']
+
+    hashed_name = True
+
     def __init__(self, path, config, context):
         super().__init__(path, config, context)
 
-    def setup_context():
+    def setup_context(self):
         super().setup_context()
 
-        dest = self['src']
+        dest = self.src.relative_to(self.config['source'])
         if self.config['prettify_urls']:
             dest = prettify_path(dest)
-        self.dest = output / dest
-        self['dest'] = dest.as_posix()
+        # Files without an extension, like CNAME, are usually looked up by name, so they keep it
+        if self.config['fingerprint_assets'] and self.hashed_name and dest.suffix:
+            digest = self.config.get_hash_cache().get(self.src)
+            dest = dest.with_name(f'{dest.stem}.{digest[:HASHED_NAME_LENGTH]}{dest.suffix}')
+        self.dest = self.config['output'] / dest
+        self['dest'] = self.dest.as_posix()
 
-        self['url'] = quote(self.dest.relative_to(output))
+        self['url'] = quote(self.dest.relative_to(self.config['output']).as_posix())
+
+    # Assets can be large, so they are fingerprinted by size and mtime rather than hashed
+    def source_signature(self):
+        stat = self.src.stat()
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
 
-    def write_artifact():
-        shutil.copy(self['src'], self['dest'])
+    def fingerprint(self):
+        inputs = super().fingerprint()
+        inputs['copy_mode'] = self.config['copy_mode']
+        return inputs
+
+    # Copies keep the source's mtime, so the output is recorded by size and mtime too instead of being read back
+    def write_artifact(self):
+        self['copied_bytes'], self['skipped_bytes'] = sync_file(self.src, self.dest, self.config['copy_mode'])
+        stat = os.stat(self.dest)
+        self['output_hash'] = f'{stat.st_size}:{stat.st_mtime_ns}'
 
 class TemplateAsset(Asset):
+
+    heavy_fields = ['raw_content', 'text_content']
+
+    # The output depends on the site it is rendered with, not just the source
+    hashed_name = False
     
     def __init__(self, path, config, context):
         super().__init__(path, config, context)
 
-    @static_method
-    def is_supported(self, path):
+    @staticmethod
+    def is_supported(path):
         try:
             with open(path, 'r') as f:
                 pass
@@ -160,15 +335,85 @@ class TemplateAsset(Asset):
         except:
             return False
 
-    def setup_context():
-        super().setup_context()
+    def read_content(self):
         with open(self.src, 'r') as f:
             self['raw_content'] = f.read()
 
     def render_content(self):
-        self['text_content'] = Template(self['raw_content']).render(**self.global_context, **self)
+        self['reads_listing'] = False
+        templates = self.config.get_templates()
+        self['text_content'] = templates.render(templates.from_string(self['raw_content'], bytecode=False), self.render_context)
+
+    def get_output(self):
+        return self['text_content'].encode('utf-8')
+
+    def write_artifact(self):
+        self.config.get_output_dirs().make(self.dest.parent)
+        writer = AtomicFile(self.dest, self.last_output)
+        with writer as f:
+            f.write(self['text_content'])
+        self['output_hash'] = writer.digest
+
+# Assets concatenated into one file, in the order given, and minified. Its src is where the bundle would be in the
+# source directory, which has no file of its own.
+class Bundle(Artifact):
+
+    heavy_fields = ['raw_content', 'text_content']
+
+    hashed_name = True
+
+    def __init__(self, path, config, context, members):
+        super().__init__(path, config, context)
+        self.members = members
+
+    def setup_context(self):
+        super().setup_context()
+
+        dest = self.src.relative_to(self.config['source'])
+        if self.config['fingerprint_assets'] and dest.suffix:
+            cache = self.config.get_hash_cache()
+            digest = hash_text(repr([cache.get(x.src) for x in self.members] + [self.minify_version()]))
+            dest = dest.with_name(f'{dest.stem}.{digest[:HASHED_NAME_LENGTH]}{dest.suffix}')
+        self.dest = self.config['output'] / dest
+        self['dest'] = self.dest.as_posix()
+
+        self['url'] = quote(self.dest.relative_to(self.config['output']).as_posix())
+
+    def minify_version(self):
+        return MINIFY_VERSION if self.config['minify_bundles'] else None
+
+    # Like assets, members are fingerprinted by size and mtime
+    def fingerprint(self):
+        inputs = super().fingerprint()
+        members = []
+        for member in self.members:
+            stat = member.src.stat()
+            members.append([member['src'], f'{stat.st_size}:{stat.st_mtime_ns}'])
+        inputs['members'] = members
+        inputs['minify'] = self.minify_version()
+        return inputs
+
+    def read_content(self):
+        contents = []
+        for member in self.members:
+            with open(member.src, 'r') as f:
+                contents.append(f.read())
+        self['raw_content'] = contents
+
+    # Scripts are joined with a semicolon, so a file that doesn't end its last statement can't run into the next one
+    def convert_content(self):
+        ext = self.dest.suffix
+        contents = self['raw_content']
+        if self.config['minify_bundles']:
+            contents = [minify(x, ext) for x in contents]
+        self['text_content'] = (';\n' if ext == '.js' else '\n').join(contents) + '\n'
+
+    def get_output(self):
+        return self['text_content'].encode('utf-8')
 
     def write_artifact(self):
-        self.dest.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.dest, 'w+') as f:
+        self.config.get_output_dirs().make(self.dest.parent)
+        writer = AtomicFile(self.dest, self.last_output)
+        with writer as f:
             f.write(self['text_content'])
+        self['output_hash'] = writer.digest
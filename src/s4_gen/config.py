@@ -1,20 +1,26 @@
+import os
 from pathlib import Path
+from types import MappingProxyType
 from warnings import warn
 from enum import Enum
 import tomllib
 
-from jinja2 import Template
-
-from s4_gen.utils import filename_to_title
+from s4_gen.utils import filename_to_title, OutputDirs, BuildLock
+from s4_gen.sync import COPY_MODES
+from s4_gen.convert_cache import ConversionCache
+from s4_gen.hash_cache import HashCache
 
 class SchemaValue:
 
+    # Lazy values are left out of the snapshot and resolved the first time they are read
+    lazy = False
+
     def __init__(self, type, fallbacks, typestr=None):
         self.type = type
         self.typestr = typestr if typestr else str(type)
         self.fallbacks = fallbacks
 
-    def convert_value(self, value):
+    def convert_value(self, value, conf):
         if isinstance(value, self.type):
             return value
         else:
@@ -34,7 +40,7 @@ class StrListSchemaValue(SchemaValue):
     def __init__(self, fallbacks):
         super().__init__(list, fallbacks, 'list[str]')
 
-    def convert_value(self, value):
+    def convert_value(self, value, conf):
         if isinstance(value, self.type) and all([isinstance(x, str) for x in value]):
             return value
         elif isinstance(value, str):
@@ -46,7 +52,7 @@ class BoolSchemaValue(SchemaValue):
     def __init__(self, fallbacks):
         super().__init__(bool, fallbacks)
 
-    def convert_value(self, value):
+    def convert_value(self, value, conf):
         if isinstance(value, self.type):
             return value
         elif value in [1, 0]:
@@ -56,6 +62,10 @@ class BoolSchemaValue(SchemaValue):
         else:
             raise ValueError()
 
+class IntSchemaValue(SchemaValue):
+    def __init__(self, fallbacks):
+        super().__init__(int, fallbacks, 'int')
+
 class StrSchemaValue(SchemaValue):
     def __init__(self, fallbacks):
         super().__init__(str, fallbacks, 'str')
@@ -64,11 +74,11 @@ class PathSchemaValue(SchemaValue):
     def __init__(self, fallbacks):
         super().__init__(Path, fallbacks)
 
-    def convert_value(self, value):
+    def convert_value(self, value, conf):
         if isinstance(value, self.type):
             return value.resolve()
         elif isinstance(value, str):
-            return Path(str).resolve()
+            return Path(value).resolve()
         else:
             raise ValueError()
 
@@ -76,7 +86,7 @@ class EnumSchemaValue(SchemaValue):
     def __init__(self, enum, fallbacks):
         super().__init__(enum, fallbacks, 'one of ' + ', '.join(str(dir(enum))))
 
-    def convert_value(self, value): #TODO: Add fuzzy string matching for enums
+    def convert_value(self, value, conf): #TODO: Add fuzzy string matching for enums
         if isinstance(value, self.type):
             return value
         elif isinstance(value, str) and value.lower() in [x.lower() for x in dir(self.type)]:
@@ -86,27 +96,31 @@ class EnumSchemaValue(SchemaValue):
 
 class StrSelectSchemaValue(SchemaValue):
     def __init__(self, strs, fallbacks):
-        super().__init__(str, fallbacks, 'one of ' + ', '.join(strs)
+        super().__init__(str, fallbacks, 'one of ' + ', '.join(strs))
         self.strs = strs
 
-    def convert_value(self, value): #TODO: Add fuzzy string matching for enums
+    def convert_value(self, value, conf): #TODO: Add fuzzy string matching for enums
         if  value in self.strs:
             return value
         else:
             raise ValueError()
 
 class TemplateSchemaValue(SchemaValue):
+
+    # Compiling templates needs Jinja, so only do it once a page needs the template
+    lazy = True
+
     def __init__(self, fallbacks):
-        super().__init__(Template, fallbacks)
+        super().__init__(None, fallbacks, 'template file path or string')
 
-    def convert_value(self, value):
-        if isinstance(value, self.type):
+    def convert_value(self, value, conf):
+        from jinja2 import Template
+        if isinstance(value, Template):
             return value
         elif isinstance(value, Path):
             if value.exists():
                 try:
-                    with open(value, 'r') as f:
-                        return Template(f.read())
+                    return conf.get_templates().from_file(value)
                 except:
                     raise ValueError('Could not read file!')
             else:
@@ -114,12 +128,11 @@ class TemplateSchemaValue(SchemaValue):
         elif isinstance(value, str):
             if Path(value).exists():
                 try:
-                    with open(value, 'r') as f:
-                        return Template(f.read())
+                    return conf.get_templates().from_file(value)
                 except:
                     raise ValueError('Could not read file!')
             else:
-                return Template(value)
+                return conf.get_templates().from_string(value)
         else:
             raise ValueError() 
 
@@ -150,22 +163,22 @@ class FuncFallback:
         self.func = func
 
     def __call__(self, conf):
-        return self.func()
+        return self.func(conf)
 
-DEFAULT_TEMPLATE_PATH = Path(__file__).parent / 'data/default_template.html'
-DEFAULT_TEMPLATE = None
-with open(DEFAULT_TEMPLATE_PATH, 'r') as f:
-    DEFAULT_TEMPLATE = Template(f.read())
+class TemplateFallback:
+    def __init__(self, path):
+        self.path = path
 
+    def __call__(self, conf):
+        return conf.get_templates().from_file(self.path)
+
+DEFAULT_TEMPLATE_PATH = Path(__file__).parent / 'data/default_template.html'
 DEFAULT_NAV_TEMPLATE_PATH = Path(__file__).parent / 'data/default_nav_template.html'
-DEFAULT_NAV_TEMPLATE = None
-with open(DEFAULT_NAV_TEMPLATE_PATH, 'r') as f:
-    DEFAULT_NAV_TEMPLATE = Template(f.read())
 
 def ignore_fallback_func(conf):
-    ignore = ['**/.*', './s4-toml']
-    if conf['source'] in conf.path.parents:
-        ignore.append(conf.path.relative_to(conf['source']).as_posix())
+    ignore = ['**/.*', 's4.toml']
+    if conf.path and conf['source'] in Path(conf.path).resolve().parents:
+        ignore.append(Path(conf.path).resolve().relative_to(conf['source']).as_posix())
     if conf['source'] in conf['output'].parents:
         ignore.append(conf['output'].relative_to(conf['source']).as_posix())
     return ignore
@@ -173,15 +186,28 @@ def ignore_fallback_func(conf):
 SITE_SCHEMA = {
     'output': PathSchemaValue([ValueFallback(Path('./output').resolve())]),
     'source': PathSchemaValue([ValueFallback(Path('.').resolve())]),
+    'cache': PathSchemaValue([ValueFallback(Path('./.s4-cache').resolve())]),
     'assets': StrListSchemaValue([ValueFallback(['**/*.css', '**/*.js', '**/*.png', '**/*.svg', '**/*.jpg', '**/*.jpeg', '**/*.gif', 'CNAME'])]),
     'pages': StrListSchemaValue([ValueFallback(['**', '**/*.html', '**/*.md', '**/*.txt'])]),
     'template_assets': StrListSchemaValue([ValueFallback([])]),
     'ignore': StrListSchemaValue([FuncFallback(ignore_fallback_func)]),
     'auto_nav_pages': BoolSchemaValue([ValueFallback(True)]),
+    'nav_page_size': IntSchemaValue([ValueFallback(0)]),
+    'nav_sort': StrSchemaValue([]),
     'prettify_urls': BoolSchemaValue([ValueFallback(True)]),
+    'copy_mode': StrSelectSchemaValue(COPY_MODES, [ValueFallback('copy')]),
+    'fingerprint_assets': BoolSchemaValue([ValueFallback(False)]),
+    'bundles': DictSchemaValue([ValueFallback({})]),
+    'minify_bundles': BoolSchemaValue([ValueFallback(True)]),
+    'io_threads': IntSchemaValue([ValueFallback(8)]),
+    'read_ahead': IntSchemaValue([ValueFallback(32)]),
+    'convert_cache_size': IntSchemaValue([ValueFallback(256)]),
+    'search_index': BoolSchemaValue([ValueFallback(False)]),
+    'search_dir': StrSchemaValue([ValueFallback('search')]),
+    'search_prefix': IntSchemaValue([ValueFallback(2)]),
     'home': StrSchemaValue([]),
-    'template': TemplateSchemaValue([ValueFallback(DEFAULT_TEMPLATE)]),
-    'nav_template': TemplateSchemaValue([ValueFallback(DEFAULT_NAV_TEMPLATE)]),
+    'template': TemplateSchemaValue([TemplateFallback(DEFAULT_TEMPLATE_PATH)]),
+    'nav_template': TemplateSchemaValue([TemplateFallback(DEFAULT_NAV_TEMPLATE_PATH)]),
     'icon': PathSchemaValue([]),
     'logo': PathSchemaValue([KeyFallback('icon')]),
     'website_title': StrSchemaValue([FuncFallback(lambda x: filename_to_title(x['source'].name))]),
@@ -190,7 +216,7 @@ SITE_SCHEMA = {
 
 ARTIFACT_SCHEMA = {
     'prettify_urls': BoolSchemaValue([ValueFallback(True)]),
-    'template': TemplateSchemaValue([ValueFallback(DEFAULT_TEMPLATE)]),
+    'template': TemplateSchemaValue([TemplateFallback(DEFAULT_TEMPLATE_PATH)]),
     
 }
 
@@ -203,20 +229,37 @@ class Config:
         self.root = self if root is None else root
         self.key = key
         self.schema = schema
+        self.templates = None
+        self.conversion_cache = None
+        self.hash_cache = None
+        self.output_dirs = None
+        self.search_index = None
+        self.build_lock = None
+        self.overrides = dict(data) if data else {}
+        self.mtime = None
+        self.snapshot = None
+        self.deferred = {}
+        self.resolving = None
+        self.stats = {'conversions': 0, 'fallbacks': 0} if root is None else root.stats
+
+        self._load_data()
+
+    def _load_data(self):
 
         _data = {}
         
-        if path:
-            with open(path, 'rb') as f:
+        if self.path:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'rb') as f:
                 _data = tomllib.load(f)
                 
-        if data:
-            _data.update(data)
+        _data.update(self.overrides)
 
+        self.data = {}
         for k, v in _data.items():
             if isinstance(v, dict):
                 if k in self.schema and self.schema[k].type != dict:
-                    self.data[k] = Config(None, v, self.schema[k], [*self.key, k], root)
+                    self.data[k] = Config(None, v, self.schema[k], [*self.key, k], self.root)
                 else:
                     self.data[k] = v
             else:
@@ -224,23 +267,116 @@ class Config:
 
     def __getitem__(self, key):
 
+        # While the snapshot is being resolved, fallbacks read the values resolved so far
+        if self.resolving is not None:
+            return self._resolve(key)
+
+        snapshot = self.get_snapshot()
+        if key in snapshot:
+            return snapshot[key]
+        elif key in self.schema:
+            if key not in self.deferred:
+                self.deferred[key] = self._convert(key)
+            return self.deferred[key]
+        else:
+            keystr = '.'.join([*self.key, key])
+            print(f'WARNING: No value for {keystr} provided and key is not in config schema.')
+            return None #Throw warning here?
+
+    # Every schema and data key (except lazy ones), converted and validated once; rebuilt only after __setitem__ or refresh()
+    def get_snapshot(self):
+        if self.snapshot is None:
+            self.resolving = {}
+            try:
+                for key in [*self.schema, *self.data]:
+                    if key not in self.schema or not self.schema[key].lazy:
+                        self._resolve(key)
+                self.snapshot = MappingProxyType(self.resolving)
+            finally:
+                self.resolving = None
+        return self.snapshot
+
+    def _resolve(self, key):
+        if key not in self.resolving:
+            self.resolving[key] = self._convert(key)
+        return self.resolving[key]
+
+    def _convert(self, key):
+
         if key in self.data:
             if key in self.schema:
                 try:
-                    return self.schema[key].convert_value(self.data[key])
+                    self.stats['conversions'] += 1
+                    return self.schema[key].convert_value(self.data[key], self.root)
                 except ValueError:
                     keystr = '.'.join([*self.key, key])
                     print(f'WARNING: "{self.data[key]}" is not a valid value for {keystr}. Expected {self.schema[key].typestr}.')
+                    self.stats['fallbacks'] += 1
                     return self.schema[key].get_fallback(self.root)
             else:
                 return self.data[key] #Throw warning here?
         else:
             if key in self.schema:
+                self.stats['fallbacks'] += 1
                 return self.schema[key].get_fallback(self.root)
             else:
-                keystr = '.'.join([*self.key, key])
-                print(f'WARNING: No value for {keystr} provided and key is not in config schema.')
-                return None #Throw warning here?
+                return None
+
+    # Reload the config file if it changed on disk. Returns True if the snapshot was invalidated.
+    def refresh(self):
+        if not self.path or os.stat(self.path).st_mtime_ns == self.mtime:
+            return False
+        self._load_data()
+        self.templates = None
+        self.search_index = None
+        self.invalidate()
+        return True
+
+    def invalidate(self):
+        self.root.snapshot = None
+        self.root.deferred = {}
+        self.snapshot = None
+        self.deferred = {}
+
+    # The site's Jinja environment, created on first use since it depends on the source and cache settings
+    def get_templates(self):
+        if self.root.templates is None:
+            from s4_gen.templates import Templates
+            self.root.templates = Templates(self.root['source'], self.root['cache'])
+        return self.root.templates
+
+    # Cache of converted page sources, kept in the cache directory and capped at convert_cache_size megabytes
+    def get_conversion_cache(self):
+        if self.root.conversion_cache is None:
+            self.root.conversion_cache = ConversionCache(self.root['cache'] / 'convert', self.root['convert_cache_size'] * 1024 * 1024)
+        return self.root.conversion_cache
+
+    # Content hashes of assets, for naming them after their content
+    def get_hash_cache(self):
+        if self.root.hash_cache is None:
+            self.root.hash_cache = HashCache(self.root['cache'] / 'hashes.json')
+        return self.root.hash_cache
+
+    def get_output_dirs(self):
+        if self.root.output_dirs is None:
+            self.root.output_dirs = OutputDirs()
+        return self.root.output_dirs
+
+    # Held while building, so only one process builds the site at a time. A cache directory changed in the config
+    # gets its own lock once the old one is released.
+    def get_build_lock(self):
+        path = self.root['cache'] / 'build.lock'
+        if self.root.build_lock is None or (self.root.build_lock.path != path and self.root.build_lock.depth == 0):
+            self.root.build_lock = BuildLock(path)
+        return self.root.build_lock
+
+    def get_search_index(self):
+        if self.root.search_index is None:
+            from s4_gen.search import SearchIndex
+            self.root.search_index = SearchIndex(self.root['cache'] / 'search', self.root['output'] / self.root['search_dir'], self.root['search_prefix'])
+        return self.root.search_index
 
     def __setitem__(self, key, value):
         self.data[key] = value #Type check using schema?
+        self.overrides[key] = value
+        self.invalidate()
@@ -1,29 +1,81 @@
-import mistletoe
+import re
+from html import escape
 
-converters = {
-    ('.txt', '.html'): txt2html,
-    ('.md', '.html'): md2html,
-    
-}
+# A url, or a run of blank lines ending a paragraph
+TEXT_TOKENS = re.compile(r'(?P<url>https?://[^\s<>"]+)|(?P<paragraph>\n(?:[ \t\r\f\v]*\n)+)')
+URL_TRAILING = '.,;:!?\'"'
 
-def convert(text, from_ext, to_ext):
-    if from_ext == to_ext:
-        return text
-    if (from_ext, to_ext) in converters:
-        return converters[(from_ext, to_ext)](text)
-    raise ValueError(f'Cannot convert from file of type "{from_ext}" to "{to_ext}"')
+# Leave sentence punctuation and unbalanced closing brackets after a url out of the link
+def _trim_url(url):
+    while url:
+        if url[-1] in URL_TRAILING:
+            url = url[:-1]
+        elif url[-1] == ')' and url.count(')') > url.count('('):
+            url = url[:-1]
+        else:
+            break
+    return url
 
+# Escape the text, link its urls and wrap its paragraphs in one scan
 def txt2html(text):
-        _html_text = text
-        
-        urls = re.findall('https?://.*\\W', _html_text)
-        for url in urls:
-            _html_text = _html_text.replace(url, f'<a href="{url}">{url}</a>')
-        
-        para = [x for x in _html_text.split('\n\n') if not x.isspace()]
-        _html_text = '<p>\n' + '\n</p>\n<p>\n'.join(para) + '\n</p>'
+    paragraphs = []
+    parts = []
+    blank = True
+    pos = 0
+    for match in TEXT_TOKENS.finditer(text):
+        if pos < match.start():
+            chunk = text[pos:match.start()]
+            parts.append(escape(chunk, quote=False))
+            blank = blank and chunk.isspace()
+        if match.lastgroup == 'url':
+            url = _trim_url(match.group())
+            parts.append(f'<a href="{escape(url)}">{escape(url, quote=False)}</a>')
+            pos = match.start() + len(url)
+            blank = False
+        else:
+            if not blank:
+                paragraphs.append(''.join(parts))
+            parts = []
+            blank = True
+            pos = match.end()
+    if pos < len(text):
+        chunk = text[pos:]
+        parts.append(escape(chunk, quote=False))
+        blank = blank and chunk.isspace()
+    if not blank:
+        paragraphs.append(''.join(parts))
 
-        return _html_text
+    return '<p>\n' + '\n</p>\n<p>\n'.join(paragraphs) + '\n</p>'
 
 def md2html(text):
+    import mistletoe
     return mistletoe.markdown(text)
+
+def mistletoe_version():
+    import mistletoe
+    return mistletoe.__version__
+
+# Converter function, name and version for each conversion. The name and version are part of the
+# conversion cache key, so bump the version whenever a converter's output changes.
+# A version can also be a function, so converters don't have to be imported to build the table.
+converters = {
+    ('.txt', '.html'): (txt2html, 'txt2html', '2'),
+    ('.md', '.html'): (md2html, 'mistletoe', mistletoe_version),
+}
+
+def convert(text, from_ext, to_ext, cache=None):
+    if from_ext == to_ext:
+        return text
+    if (from_ext, to_ext) not in converters:
+        raise ValueError(f'Cannot convert from file of type "{from_ext}" to "{to_ext}"')
+    func, name, version = converters[(from_ext, to_ext)]
+    if cache is None:
+        return func(text)
+    if callable(version):
+        version = version()
+    key = cache.key(text, name, version)
+    result = cache.get(key)
+    if result is None:
+        result = func(text)
+        cache.put(key, result)
+    return result
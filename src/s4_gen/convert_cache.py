@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from s4_gen.utils import hash_text
+
+# Converted documents stored on disk by a hash of their source and converter, evicted least recently used first
+class ConversionCache:
+
+    def __init__(self, path, max_size):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, name, version, options=None):
+        return hash_text('\0'.join([name, version, repr(options), text]))
+
+    def _entry(self, key):
+        return self.path / key[:2] / key
+
+    def get(self, key):
+        entry = self._entry(key)
+        try:
+            with open(entry, 'r', encoding='utf-8') as f:
+                result = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Mark the entry as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, text):
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry.parent)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, entry)
+
+    def entries(self):
+        if not self.path.exists():
+            return []
+        return [x for shard in os.scandir(self.path) if shard.is_dir() for x in os.scandir(shard) if x.is_file()]
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'entries': len(entries),
+            'size': sum(x.stat().st_size for x in entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    # Remove least recently used entries until the cache fits in max_size. Returns the number removed.
+    def prune(self):
+        entries = [(x.stat(), x.path) for x in self.entries()]
+        size = sum(x.st_size for x, _ in entries)
+        removed = 0
+        for stat, path in sorted(entries, key=lambda x: x[0].st_mtime_ns):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= stat.st_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
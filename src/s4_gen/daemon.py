@@ -0,0 +1,154 @@
+import json
+import os
+import socket
+from pathlib import Path
+
+SOCKET_NAME = 'daemon.sock'
+# Seconds to wait for a daemon to accept the connection. Waiting for the build itself is up to the caller.
+CONNECT_TIMEOUT = 5
+
+# Each site's daemon listens in its cache directory, so builds of a site find it from the config alone
+def socket_path(config):
+    return config['cache'] / SOCKET_NAME
+
+def config_id(config):
+    return str(Path(config.path).resolve()) if config.path else None
+
+def _connect(path):
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+# Ask the daemon of the site with this config to build it. Returns its response, or None if no daemon is running or
+# it went away mid-request. A daemon that doesn't answer within timeout seconds (None waits forever) is given up on.
+def request_build(config, options, timeout=None):
+    sock = _connect(socket_path(config))
+    if sock is None:
+        return None
+    sock.settimeout(timeout)
+    try:
+        with sock, sock.makefile('rwb') as f:
+            f.write((json.dumps({**options, 'config': config_id(config)}) + '\n').encode('utf-8'))
+            f.flush()
+            line = f.readline()
+    except socket.timeout:
+        return {'error': f'The daemon on "{socket_path(config)}" did not finish the build within {timeout:g} seconds.', 'fallback': True}
+    except OSError:
+        return None
+    try:
+        return json.loads(line) if line else None
+    except ValueError:
+        return None
+
+# Keeps a loaded site in memory between builds, with its compiled templates and directory index. A build request only
+# re-reads and re-renders the source files whose mtime or size changed since the last one, like serve --watch does.
+# Page content isn't kept: pages a change affects are read again, and their converted HTML comes from the on-disk
+# conversion cache rather than memory.
+class BuildDaemon:
+
+    def __init__(self, site):
+        self.site = site
+        self.path = socket_path(site.config)
+        self.config = config_id(site.config)
+        self.watcher = None
+        # Mtimes of files outside the source tree the last build depended on (templates, the manifest)
+        self.outside = {}
+
+    def serve_forever(self):
+        import socketserver
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('The build daemon needs Unix domain sockets, which this platform does not support.')
+        sock = _connect(self.path)
+        if sock is not None:
+            sock.close()
+            raise ValueError(f'A build daemon is already running on "{self.path}".')
+        # Left behind by a daemon that didn't shut down cleanly
+        self.path.unlink(missing_ok=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    options = json.loads(self.rfile.readline())
+                except ValueError:
+                    return
+                self.wfile.write((json.dumps(daemon.handle(options)) + '\n').encode('utf-8'))
+
+        with socketserver.UnixStreamServer(str(self.path), Handler) as server:
+            print(f'Build daemon listening on {self.path}')
+            try:
+                server.serve_forever()
+            finally:
+                self.path.unlink(missing_ok=True)
+
+    # Requests are handled one at a time, so builds never overlap
+    def handle(self, options):
+        if options.get('config') != self.config:
+            return {'error': f'The daemon on "{self.path}" builds a site with a different config file.', 'fallback': True}
+        try:
+            return {'report': self.build(options)}
+        except Exception as e:
+            # The next request starts over with a regular build
+            self.watcher = None
+            print(f'ERROR: Build failed: {e}')
+            return {'error': f'Build failed: {e}', 'fallback': False}
+
+    def build(self, options):
+        site = self.site
+        # Builds without the daemon are turned away until this one is done, rather than writing the same output at once
+        with site.config.get_build_lock():
+            if options.get('clean'):
+                site.clean()
+
+            # Anything changed behind the daemon's back takes a regular build of the rediscovered source files, which checks
+            # every artifact against the manifest
+            artifacts = None
+            if self.watcher is None or options.get('full') or not self._is_current():
+                self.watcher = site.watcher()
+                site.reload()
+            else:
+                added, modified, removed = self.watcher.poll()
+                artifacts = site.affected_artifacts(added, modified, removed)
+
+            if artifacts is None:
+                site.build(full=options.get('full', False), jobs=options.get('jobs', 1), stream=options.get('stream', False), changes=options.get('changes'))
+            else:
+                site.changes_path = Path(options['changes']) if options.get('changes') else site.config['cache'] / 'changes.json'
+                site.rebuild(artifacts)
+            # Keep the site's metadata between builds, but not the content of every page (see above)
+            for artifact in site.artifacts:
+                artifact.release()
+            self.outside = self._outside_mtimes()
+
+            if options.get('publish'):
+                site.publish(options['publish'])
+            return site.report
+
+    def _outside_mtimes(self):
+        paths = [*self.site.config.get_templates().dependencies(), self.site.manifest.path]
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    # Whether the config, the templates, the manifest (e.g. written by a build without the daemon) and the output
+    # directory are as the last build left them
+    def _is_current(self):
+        if self.site.config.refresh():
+            return False
+        if self.outside != self._outside_mtimes():
+            self.site.config.invalidate()
+            return False
+        return self.site.config['output'].is_dir()
@@ -0,0 +1,85 @@
+import os
+import re
+from pathlib import Path
+
+def _translate(part):
+    regex = ''
+    i = 0
+    while i < len(part):
+        c = part[i]
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[' and ']' in part[i + 1:]:
+            end = part.index(']', i + 1)
+            body = part[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += '[' + body + ']'
+            i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+# Compile a glob relative to the source directory into a regex over posix relative paths.
+# As with pathlib, a pattern ending in '**' only matches directories (including the one it starts from).
+def compile_glob(pattern):
+    if pattern.startswith('./'):
+        pattern = pattern[2:]
+    parts = pattern.strip('/').split('/')
+    regex = ''
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == '**' and not last:
+            regex += '(?:.*/)?'
+        elif part == '**':
+            regex = regex[:-1] + '(?:/.*)?' if regex else '.*'
+        else:
+            regex += _translate(part) + ('' if last else '/')
+    return re.compile(regex), parts[-1] == '**'
+
+# Walks the source tree once, matching every path against all artifact globs and pruning ignored directories
+class FileWalker:
+
+    # groups is a list of (globs, artifact types) in priority order
+    def __init__(self, source, groups, ignore=[], exclude=[]):
+        self.source = Path(source)
+        self.groups = [([compile_glob(x) for x in globs], types) for globs, types in groups]
+        self.ignore = [compile_glob(x)[0] for x in ignore]
+        self.exclude = {Path(x) for x in exclude}
+
+    # Yields (path, artifact type) pairs, directories before their contents and entries sorted by name
+    def walk(self):
+        yield from self._visit(self.source, '', True)
+
+    def _visit(self, path, rel, is_dir):
+        artifact_type = self._match(path, rel, is_dir)
+        if artifact_type is not None:
+            yield path, artifact_type
+        if not is_dir:
+            return
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda x: x.name)
+        except OSError:
+            return
+        for entry in entries:
+            child = Path(entry.path)
+            child_rel = rel + '/' + entry.name if rel else entry.name
+            if child in self.exclude or any(x.fullmatch(child_rel) for x in self.ignore):
+                continue
+            try:
+                child_is_dir = entry.is_dir()
+            except OSError:
+                continue
+            yield from self._visit(child, child_rel, child_is_dir)
+
+    def _match(self, path, rel, is_dir):
+        for globs, types in self.groups:
+            if any(regex.fullmatch(rel) and (is_dir or not dirs_only) for regex, dirs_only in globs):
+                for artifact_type in types:
+                    if artifact_type.is_supported(path):
+                        return artifact_type
+        return None
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from s4_gen.utils import hash_file
+
+# Content hashes of source files, kept by path with the size and mtime they were hashed at, so only files that
+# changed since the last build are read again
+class HashCache:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = None
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, path):
+        if self.entries is None:
+            self.load()
+        key = Path(path).as_posix()
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = [stat.st_size, stat.st_mtime_ns, hash_file(path)]
+        self.used[key] = entry
+        return entry[2]
+
+    # Only the files looked up since the last save are kept, so deleted files drop out
+    def save(self):
+        if self.used == self.entries:
+            self.used = {}
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.used, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self.entries = self.used
+        self.used = {}
@@ -0,0 +1,54 @@
+from urllib.parse import unquote
+
+# Pages grouped by output directory, so directory listings are lookups instead of scans over every artifact
+class DirectoryIndex:
+
+    def __init__(self, output):
+        self.output = output
+        self.pages = []
+        self.dirs = {}
+        self.subdirs = {}
+        self.by_dest = {}
+        self.by_url = {}
+
+    def add(self, artifact):
+        if artifact.dest is None or artifact.dest.suffix != '.html' or not artifact.listed:
+            return
+        self.pages.append(artifact)
+        self.dirs.setdefault(artifact.dest.parent, []).append(artifact)
+        self.subdirs.setdefault(artifact.dest.parent.parent, []).append(artifact)
+        self.by_dest[artifact.dest] = artifact
+        self.by_url[unquote(artifact['url'])] = artifact
+
+    def remove(self, artifact):
+        if self.by_dest.get(artifact.dest) is not artifact:
+            return
+        self.pages.remove(artifact)
+        self.dirs[artifact.dest.parent].remove(artifact)
+        self.subdirs[artifact.dest.parent.parent].remove(artifact)
+        del self.by_dest[artifact.dest]
+        del self.by_url[unquote(artifact['url'])]
+
+    # Pages in the same output directory as dest, excluding dest itself
+    def siblings(self, dest):
+        return [x for x in self.dirs.get(dest.parent, []) if x.dest != dest]
+
+    def root_pages(self):
+        return self.dirs.setdefault(self.output, [])
+
+    def get(self, url):
+        return self.by_url.get(unquote(url))
+
+    # Pages one directory below the page at url
+    def children(self, url):
+        page = self.get(url)
+        if page is None:
+            return []
+        return self.subdirs.get(page.dest.parent, [])
+
+    # Index page of the directory above the page at url
+    def parent(self, url):
+        page = self.get(url)
+        if page is None:
+            return None
+        return self.by_dest.get(page.dest.parent.parent / 'index.html')
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+MANIFEST_VERSION = 2
+
+# Record of what each artifact was last built from and what it wrote, stored in the build cache dir
+class Manifest:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.site = None
+        self.artifacts = {}
+        # Hashes of output files written by the site itself rather than an artifact (the home redirect, the search index), by dest
+        self.files = {}
+        # Hashes of the template files (layouts, includes, ...) the pages were rendered with, by path
+        self.templates = {}
+        # Hash of the page listing (every page's url and title) the last build rendered with
+        self.listing = None
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.site = data.get('site')
+        self.artifacts = data.get('artifacts', {})
+        self.files = data.get('files', {})
+        self.templates = data.get('templates', {})
+        self.listing = data.get('listing')
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w+') as f:
+            json.dump({'version': MANIFEST_VERSION, 'site': self.site, 'artifacts': self.artifacts, 'files': self.files, 'templates': self.templates, 'listing': self.listing}, f, indent=1)
+
+    # An artifact is stale if any of its recorded inputs differ or its output is missing, or if its last render read the
+    # page listing and that changed
+    def is_stale(self, artifact, inputs, listing=None):
+        entry = self.artifacts.get(artifact['src'])
+        if entry is None or artifact.dest is None or not artifact.dest.exists():
+            return True
+        if entry.get('reads_listing') and listing != self.listing:
+            return True
+        return any(entry.get(k) != v for k, v in inputs.items())
+
+    # Hash of every output file the last build wrote, by dest
+    def outputs(self):
+        outputs = dict(self.files)
+        outputs.update((x['dest'], x.get('output')) for x in self.artifacts.values())
+        return outputs
@@ -0,0 +1,129 @@
+import re
+
+# Bump whenever the minifiers' output changes, so bundles are rebuilt
+MINIFY_VERSION = '2'
+
+CSS_TOKENS = re.compile(r'(?P<string>"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(?P<comment>/\*.*?\*/)|(?P<space>\s+)', re.S)
+# Whitespace next to these can go, e.g. "a > b { color: red; }" becomes "a>b{color:red}"
+CSS_NO_SPACE_AFTER = '{};,>:('
+CSS_NO_SPACE_BEFORE = '{};,>)!'
+CSS_REDUNDANT_SEMICOLONS = re.compile(r';+}')
+
+# Drop comments, and collapse whitespace, leaving it out around punctuation. Strings are kept as they are.
+def minify_css(text):
+    out = []
+    space = False
+    pos = 0
+    for match in CSS_TOKENS.finditer(text):
+        if pos < match.start():
+            space = _append_css(out, text[pos:match.start()], space)
+        if match.lastgroup == 'string':
+            space = _append_css(out, match.group(), space)
+        else:
+            space = True
+        pos = match.end()
+    if pos < len(text):
+        _append_css(out, text[pos:], space)
+    return ''.join(out)
+
+# Pieces are strings or code without whitespace, so semicolons before '}' in a code piece are always redundant
+def _append_css(out, piece, space):
+    if not piece.startswith(('"', "'")):
+        piece = CSS_REDUNDANT_SEMICOLONS.sub('}', piece)
+    if out and piece[0] == '}' and out[-1].endswith(';'):
+        # Semicolons followed by whitespace or a comment, e.g. "color: red; }", may be a piece of their own
+        out[-1] = out[-1].rstrip(';')
+        if not out[-1]:
+            out.pop()
+    if space and out and out[-1][-1] not in CSS_NO_SPACE_AFTER and piece[0] not in CSS_NO_SPACE_BEFORE:
+        out.append(' ')
+    out.append(piece)
+    return False
+
+JS_TOKENS = re.compile(r'(?P<string>"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`)|(?P<line_comment>//[^\n]*)'
+                       r'|(?P<block_comment>/\*.*?\*/)|(?P<newline>\s*\n\s*)|(?P<space>[ \t\f\v\r]+)|(?P<slash>/)', re.S)
+# A slash after these starts a regular expression rather than a division
+JS_REGEX_AFTER = '(,=:[!&|?{};+-*%<>~^'
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'instanceof', 'yield', 'await'}
+
+# Drop comments, blank lines and indentation, and collapse runs of spaces. Line breaks are kept, so automatic semicolon
+# insertion works as before. Scripts with template literal substitutions are left as they are, since a nested template
+# literal can't be told apart from the end of the outer one without parsing the script.
+def minify_js(text):
+    out = []
+    separator = ''
+    last = ''
+    pos = 0
+
+    def emit(piece):
+        nonlocal separator, last
+        if out and separator:
+            out.append(separator)
+        separator = ''
+        out.append(piece)
+        last = piece
+
+    while pos < len(text):
+        match = JS_TOKENS.search(text, pos)
+        end = match.start() if match else len(text)
+        if pos < end:
+            emit(text[pos:end])
+        if match is None:
+            break
+        kind = match.lastgroup
+        pos = match.end()
+        if kind == 'string':
+            if match.group().startswith('`') and '${' in match.group():
+                return text
+            emit(match.group())
+        elif kind == 'newline' or (kind == 'block_comment' and '\n' in match.group()):
+            separator = '\n'
+        elif kind in ('space', 'block_comment'):
+            separator = separator or ' '
+        elif kind == 'slash':
+            end = _regex_end(text, match.start()) if _starts_regex(last) else None
+            if end is None:
+                emit('/')
+            else:
+                emit(text[match.start():end])
+                pos = end
+    return ''.join(out)
+
+def _starts_regex(last):
+    if not last or last[-1] in JS_REGEX_AFTER:
+        return True
+    word = re.search(r'[\w$]+$', last)
+    return word is not None and word.group() in JS_REGEX_KEYWORDS
+
+# End of the regular expression literal starting at start, or None if there isn't one on the line
+def _regex_end(text, start):
+    i = start + 1
+    in_class = False
+    while i < len(text):
+        c = text[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            return None
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(text) and (text[i].isalnum() or text[i] == '_'):
+                i += 1
+            return i
+        i += 1
+    return None
+
+# Minifier for each bundle type, by extension
+minifiers = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+def minify(text, ext):
+    func = minifiers.get(ext)
+    return func(text) if func else text
@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Call func and return a timing record for it. Per-artifact calls use thread CPU time, since other artifacts may run on other threads.
+def measure(func, step, artifact=None, cpu_clock=time.thread_time):
+    rss = peak_rss()
+    cpu = cpu_clock()
+    start = time.perf_counter()
+    func()
+    end = time.perf_counter()
+    return {
+        'step': step,
+        'artifact': artifact,
+        'start': start,
+        'wall': end - start,
+        'cpu': cpu_clock() - cpu,
+        'rss_delta': peak_rss() - rss,
+        'pid': os.getpid(),
+        'tid': threading.get_ident()
+    }
+
+# Timing hook that collects every record of a build, for Chrome trace export and a slowest-artifacts table
+class Profiler:
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def trace_events(self):
+        if not self.records:
+            return []
+        origin = min(x['start'] for x in self.records)
+        return [{
+            'name': x['step'] if x['artifact'] is None else f"{x['step']} {x['artifact']}",
+            'cat': 'site' if x['artifact'] is None else 'artifact',
+            'ph': 'X',
+            'ts': (x['start'] - origin) * 1e6,
+            'dur': x['wall'] * 1e6,
+            'pid': x['pid'],
+            'tid': x['tid'],
+            'args': {'cpu_ms': x['cpu'] * 1e3, 'rss_delta': x['rss_delta']}
+        } for x in self.records]
+
+    def write_trace(self, path):
+        with open(path, 'w+') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+    # Artifacts ordered by total wall time over all their steps
+    def slowest(self, n=10):
+        totals = {}
+        for record in self.records:
+            if record['artifact'] is not None:
+                total = totals.setdefault(record['artifact'], {'wall': 0, 'cpu': 0, 'steps': {}})
+                total['wall'] += record['wall']
+                total['cpu'] += record['cpu']
+                total['steps'][record['step']] = total['steps'].get(record['step'], 0) + record['wall']
+        return sorted(totals.items(), key=lambda x: x[1]['wall'], reverse=True)[:n]
+
+    def table(self, n=10):
+        lines = [f"{'wall ms':>10} {'cpu ms':>10}  {'slowest step':<18} artifact"]
+        for artifact, total in self.slowest(n):
+            step = max(total['steps'], key=total['steps'].get)
+            lines.append(f"{total['wall'] * 1e3:>10.1f} {total['cpu'] * 1e3:>10.1f}  {step:<18} {artifact}")
+        return '\n'.join(lines)
@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import shutil
+from collections import Counter
+from html import unescape
+from pathlib import Path
+
+from s4_gen.utils import hash_text, hash_file, AtomicFile
+
+TAGS = re.compile(r'<[^>]*>')
+WORDS = re.compile(r'\w{2,}')
+
+# Bump whenever what is indexed of a page changes, so every page is indexed again
+SEARCH_VERSION = '2'
+
+# Postings held in memory before they are spilled to disk, so a full rebuild of a large site runs in bounded memory
+SPILL_LIMIT = 500000
+
+# Term frequencies of the text of an HTML document
+def tokenize(html):
+    return Counter(WORDS.findall(unescape(TAGS.sub(' ', html)).casefold()))
+
+# Shard file a term is stored in: its first prefix characters, with anything but a-z and 0-9 replaced by _
+def shard_name(term, prefix):
+    return ''.join(c if 'a' <= c <= 'z' or '0' <= c <= '9' else '_' for c in term[:prefix])
+
+# An inverted index written as output/pages.json, a list of [url, title] by page id, and one output/terms/<shard>.json per term
+# prefix, mapping each term to a flat [page id, frequency, page id, frequency, ...] list. Page ids and the terms of every
+# page are kept in cache, so an update only rewrites the shards holding terms of changed pages.
+class SearchIndex:
+
+    def __init__(self, cache, output, prefix=2):
+        self.cache = Path(cache)
+        self.output = Path(output)
+        self.prefix = prefix
+        self.ids = {}
+        # Hashes of the files written by the last update, and files it deleted, by path
+        self.written = {}
+        self.deleted = []
+
+    def _terms_path(self, src, new=False):
+        return self.cache / 'terms' / (hash_text(src)[:32] + ('.new.json' if new else '.json'))
+
+    # Tokenize a page and keep its terms until the next update(). Called for each page, possibly in worker processes.
+    def add_page(self, src, html):
+        path = self._terms_path(src, True)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w+') as f:
+            json.dump(tokenize(html), f, separators=(',', ':'))
+
+    def _read_terms(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self):
+        try:
+            with open(self.cache / 'ids.json', 'r') as f:
+                self.ids = json.load(f)
+        except (OSError, ValueError):
+            self.ids = {}
+
+    def save(self):
+        with open(self.cache / 'ids.json', 'w+') as f:
+            json.dump(self.ids, f, separators=(',', ':'))
+
+    # Merge the terms added since the last update. pages maps the src of every page in the site to its [url, title].
+    def update(self, pages):
+        self.load()
+        self.written = {}
+        self.deleted = []
+        self.cache.mkdir(parents=True, exist_ok=True)
+        spill_dir = self.cache / 'spill'
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        spill_dir.mkdir()
+
+        touched = set()
+        changed_ids = set()
+        for src in [x for x in self.ids if x not in pages]:
+            changed_ids.add(self.ids.pop(src))
+            touched.update(shard_name(x, self.prefix) for x in self._read_terms(self._terms_path(src)))
+            self._terms_path(src).unlink(missing_ok=True)
+
+        used = set(self.ids.values())
+        free = (x for x in range(len(used) + len(pages)) if x not in used)
+        spill = {}
+        spilled = 0
+        for src in pages:
+            new = self._terms_path(src, True)
+            if not new.exists():
+                continue
+            old = self._terms_path(src)
+            if src in self.ids:
+                changed_ids.add(self.ids[src])
+                touched.update(shard_name(x, self.prefix) for x in self._read_terms(old))
+            else:
+                self.ids[src] = next(free)
+            page_id = self.ids[src]
+            for term, freq in self._read_terms(new).items():
+                shard = shard_name(term, self.prefix)
+                touched.add(shard)
+                spill.setdefault(shard, []).append(f'{term}\t{page_id}\t{freq}\n')
+                spilled += 1
+            os.replace(new, old)
+            if spilled >= SPILL_LIMIT:
+                self._spill(spill)
+                spill = {}
+                spilled = 0
+        self._spill(spill)
+
+        (self.output / 'terms').mkdir(parents=True, exist_ok=True)
+        for shard in sorted(touched):
+            self._merge_shard(shard, changed_ids)
+
+        table = [None] * (max(self.ids.values(), default=-1) + 1)
+        for src, page_id in self.ids.items():
+            table[page_id] = pages[src]
+        path = self.output / 'pages.json'
+        self._write(path, table, hash_file(path) if path.is_file() else None)
+
+        self.save()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def _spill(self, spill):
+        for shard, lines in spill.items():
+            with open(self.cache / 'spill' / shard, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+
+    # Rewrite one shard without the postings of changed pages, then add their new postings
+    def _merge_shard(self, shard, changed_ids):
+        path = self.output / 'terms' / f'{shard}.json'
+        postings = {}
+        previous = None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            previous = hash_text(text)
+            postings = json.loads(text)
+        except (OSError, ValueError):
+            pass
+
+        merged = {}
+        for term, flat in postings.items():
+            pairs = [(flat[i], flat[i + 1]) for i in range(0, len(flat), 2) if flat[i] not in changed_ids]
+            if pairs:
+                merged[term] = pairs
+        try:
+            with open(self.cache / 'spill' / shard, 'r', encoding='utf-8') as f:
+                for line in f:
+                    term, page_id, freq = line.rstrip('\n').split('\t')
+                    merged.setdefault(term, []).append((int(page_id), int(freq)))
+        except OSError:
+            pass
+
+        if not merged:
+            if path.exists():
+                path.unlink()
+                self.deleted.append(path.as_posix())
+            return
+        self._write(path, {term: [x for pair in sorted(merged[term]) for x in pair] for term in sorted(merged)}, previous)
+
+    def _write(self, path, data, previous):
+        writer = AtomicFile(path, previous)
+        with writer as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        self.written[path.as_posix()] = writer.digest
@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import http.server
+import mimetypes
+import threading
+import webbrowser
+from email.utils import formatdate
+from urllib.parse import unquote, urlsplit
+
+from s4_gen.watch import LiveReload, RELOAD_PATH, inject_reload_script
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+class Response:
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.last_modified = formatdate(usegmt=True)
+        self.gzipped = gzip.compress(body) if content_type.startswith(COMPRESSIBLE_TYPES) else None
+
+# Serves the site from memory, rendering each artifact the first time its url is requested
+class DevServer:
+
+    def __init__(self, site, watch=False, address=('localhost', 8000)):
+        self.site = site
+        self.address = address
+        self.reloader = LiveReload() if watch else None
+        self.urls = {}
+        self.responses = {}
+        self.lock = threading.RLock()
+
+    def prepare(self):
+        with self.lock:
+            self.site.prepare()
+            self.urls = {unquote(x['url']): x for x in self.site.artifacts if 'url' in x}
+            self.responses = {}
+
+    # Called by Site.watch. Changed artifacts only have their context rebuilt; they are re-rendered when next requested.
+    def update(self, added, modified, removed):
+        with self.lock:
+            artifacts = self.site.affected_artifacts(added, modified, removed)
+            if artifacts is None:
+                self.prepare()
+            else:
+                for artifact in artifacts:
+                    for step in self.site.context_steps:
+                        method = getattr(artifact, step, None)
+                        if callable(method):
+                            method()
+                    self.responses.pop(unquote(artifact['url']), None)
+        self.reloader.notify()
+
+    def get(self, url):
+        response = self.responses.get(url)
+        if response is not None:
+            return response
+        with self.lock:
+            if url in self.responses:
+                return self.responses[url]
+            body = self.render(url)
+            if body is None:
+                return None
+            content_type = mimetypes.guess_type(url)[0] or 'application/octet-stream'
+            if content_type == 'text/html' and self.reloader:
+                body = inject_reload_script(body.decode('utf-8')).encode('utf-8')
+            response = Response(body, content_type)
+            self.responses[url] = response
+            return response
+
+    def render(self, url):
+        artifact = self.urls.get(url)
+        if artifact is None:
+            if url == 'index.html' and self.site.context.get('home_url'):
+                return self.site.home_redirect().encode('utf-8')
+            return None
+        for step in self.site.render_steps:
+            method = getattr(artifact, step, None)
+            if callable(method):
+                method()
+        output = artifact.get_output()
+        artifact.release()
+        return output
+
+    def make_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                self.respond(True)
+
+            def do_HEAD(self):
+                self.respond(False)
+
+            def respond(self, send_body):
+                path = unquote(urlsplit(self.path).path)
+                if path == RELOAD_PATH and server.reloader:
+                    return server.reloader.stream(self)
+
+                url = path.lstrip('/')
+                if url == '' or url.endswith('/'):
+                    url += 'index.html'
+
+                try:
+                    response = server.get(url)
+                except Exception as e:
+                    return self.send_error(500, explain=str(e))
+
+                if response is None:
+                    if url + '/index.html' in server.urls:
+                        self.send_response(301)
+                        self.send_header('Location', path + '/')
+                        self.end_headers()
+                        return
+                    return self.send_error(404)
+
+                if self.headers.get('If-None-Match') == response.etag:
+                    self.send_response(304)
+                    self.send_header('ETag', response.etag)
+                    self.end_headers()
+                    return
+
+                body = response.body
+                self.send_response(200)
+                self.send_header('Content-Type', response.content_type)
+                self.send_header('ETag', response.etag)
+                self.send_header('Last-Modified', response.last_modified)
+                self.send_header('Cache-Control', 'no-cache')
+                if response.gzipped is not None:
+                    self.send_header('Vary', 'Accept-Encoding')
+                    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                        body = response.gzipped
+                        self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+        return Handler
+
+    def serve_forever(self):
+        self.prepare()
+        if self.reloader:
+            threading.Thread(target=self.site.watch, args=(self.update,), daemon=True).start()
+        server = http.server.ThreadingHTTPServer(self.address, self.make_handler())
+        webbrowser.open('localhost:8000/')
+        server.serve_forever()
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from pathlib import Path
+
+from s4_gen.utils import hash_text
+
+METADATA_VERSION = 1
+
+# Written into each shard's output directory, so merge can check it has every shard of the same site
+SHARD_FILE = '.s4-shard.json'
+
+# Parse "K/N" into (K, N), where shards are numbered from 1
+def parse_shard(value):
+    try:
+        shard, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise ValueError(f'"{value}" is not a valid shard. Expected K/N, e.g. 2/4.')
+    if not 1 <= shard <= count:
+        raise ValueError(f'"{value}" is not a valid shard. K should be between 1 and N.')
+    return shard, count
+
+# Shard an artifact belongs to, from a hash of its source path relative to the source directory, so every
+# machine agrees on it regardless of where the site is checked out
+def shard_of(rel_src, count):
+    return int.from_bytes(hashlib.sha256(rel_src.encode('utf-8')).digest()[:8], 'big') % count + 1
+
+# The src, dest, url and title of every artifact, and the home url, i.e. everything the site-wide context is built from
+class SiteMetadata:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.home_url = None
+        self.artifacts = []
+
+    def collect(self, site):
+        source = site.config['source']
+        output = site.config['output']
+        self.home_url = site.context['home_url']
+        self.artifacts = [[
+            x.src.relative_to(source).as_posix(),
+            x.dest.relative_to(output).as_posix() if x.dest is not None else None,
+            x.get('url'),
+            x.get('title')
+        ] for x in site.artifacts]
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != METADATA_VERSION:
+            return False
+        self.home_url = data.get('home_url')
+        self.artifacts = data.get('artifacts', [])
+        return True
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w+') as f:
+            json.dump({'version': METADATA_VERSION, 'home_url': self.home_url, 'artifacts': self.artifacts}, f, separators=(',', ':'))
+
+    def digest(self):
+        return hash_text(json.dumps([self.home_url, self.artifacts]))
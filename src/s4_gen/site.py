@@ -1,11 +1,23 @@
 import tomllib
+import shutil
+import os
+import json
+from collections import ChainMap, deque
 from pathlib import Path
-import http.server
-import webbrowser
-from itertools import chain
+from urllib.parse import quote
+import threading
+import time
 
 from s4_gen.config import Config
-from s4_gen.artifact import Page, HtmlPage, PlainTextPage, MarkdownPage, Asset
+from s4_gen.artifact import Page, NavPage, HtmlPage, PlainTextPage, MarkdownPage, Asset, TemplateAsset, Bundle
+from s4_gen.discover import FileWalker, compile_glob
+from s4_gen.manifest import Manifest
+from s4_gen.index import DirectoryIndex
+from s4_gen.utils import hash_text, hash_file, AtomicFile
+from s4_gen.profile import measure
+from s4_gen.shard import SiteMetadata, SHARD_FILE, shard_of
+from s4_gen.sync import sync_file
+from s4_gen.search import SEARCH_VERSION
 
 STD_CONF_PATH = Path('./s4.toml').resolve()
 HOME_REDIRECT_HTML = """
@@ -17,65 +29,323 @@ HOME_REDIRECT_HTML = """
 </html>
 """
 
+# Site being built, inherited by forked worker processes so only artifact indices need to be sent to them
+_worker_site = None
+
+def _run_artifact_steps(job):
+    steps, index, release = job
+    artifact = _worker_site.pending[index]
+    before = dict(artifact)
+    records = []
+    for step in steps:
+        method = getattr(artifact, step, None)
+        if not callable(method):
+            continue
+        if _worker_site.timing_hooks:
+            records.append(measure(method, step, artifact.src.as_posix()))
+        else:
+            method()
+    if release:
+        artifact.release()
+    return {k: v for k, v in artifact.items() if k not in before or before[k] is not v}, records
+
 class Site:
 
     def __init__(self):
         self.config = Config()
         self.artifacts = []
-        self.context = {}
-        self.page_types = [HtmlPage, MarkdownPage, PlainTextPage, Page]
+        self.pending = []
+        self.fingerprints = {}
+        self.manifest = None
+        self.index = None
+        self.sources = {}
+        # Site-wide values over the config's context table. Artifacts keep a reference, so it is only ever updated in place.
+        self.context = ChainMap({}, {})
+        self.report = {}
+        self.shard = None
+        self.metadata = None
+        self.shared_metadata = False
+        self.previous_outputs = {}
+        self.changes = {}
+        self.changes_path = None
+        self.timing_hooks = []
+        self.timing_lock = threading.Lock()
+        self.page_types = [HtmlPage, MarkdownPage, PlainTextPage, NavPage, Page]
         self.asset_types = [Asset]
-        self.build_steps = ['setup_context', 'build_context', 'convert_content', 'render_content', 'render_artifact', 'write_artifact']
+        self.template_asset_types = [TemplateAsset]
+        # Builds leave out render_artifact, so pages are rendered by write_artifact straight into their output file.
+        # render_steps produce the output in memory instead, for serving it without writing it.
+        self.build_steps = ['setup_context', 'build_context', 'check_manifest', 'read_content', 'convert_content', 'render_content', 'index_content', 'write_artifact', 'write_search_index', 'update_manifest']
+        self.parallel_steps = ['read_content', 'convert_content', 'render_content', 'index_content', 'write_artifact']
+        self.context_steps = ['setup_context', 'build_context']
+        self.render_steps = ['read_content', 'convert_content', 'render_content', 'render_artifact']
+        self.stream_steps = ['read_content', 'convert_content', 'render_content', 'index_content', 'write_artifact']
+        # Steps that read sources or write output, which run on a thread pool for every artifact. Streaming builds read
+        # up to read_ahead artifacts ahead of the one being converted, and write in the background.
+        self.read_steps = ['read_content']
+        self.write_steps = ['write_artifact']
 
     def load(self, conf_path=None):
-        self._load_conf(conf_path)
+        self.load_config(conf_path)
         self._load_files()
 
-    def _load_conf(self, path):
+    def load_config(self, path=None):
         if path:
             self.config = Config(path)
         elif STD_CONF_PATH.exists():
             self.config = Config(STD_CONF_PATH)
         
     def _load_files(self):
-        for path in self._artifact_paths_from_globs(self.config['pages']):
-            types = [x for x in self.page_types if x.is_supported(path)]
-            if len(types) > 0:
-                self.artifacts.append(types[0](path, self.config, self.context))
-        for path in self._artifact_paths_from_globs(self.config['assets']):
-            types = [x for x in self.asset_types if x.is_supported(path)]
-            if len(types) > 0:
-                self.artifacts.append(types[0](path, self.config, self.context))
-
-    def _artifact_paths_from_globs(self, globs):
-        return [x for x in chain.from_iterable([self.config['source'].glob(x) for x in globs])
-                    if self.config['output'] not in x.parents 
-                    and x is not STD_CONF_PATH
-                    and x is not self.config.path]
+        exclude = [self.config['output'], self.config['cache'], STD_CONF_PATH]
+        if self.config.path:
+            exclude.append(Path(self.config.path).resolve())
+        page_types = self.page_types if self.config['auto_nav_pages'] else [x for x in self.page_types if x is not NavPage]
+        walker = FileWalker(self.config['source'], [
+            (self.config['pages'], page_types),
+            (self.config['assets'], self.asset_types),
+            (self.config['template_assets'], self.template_asset_types)
+        ], self.config['ignore'], exclude)
+        for path, artifact_type in walker.walk():
+            self.add_artifact(artifact_type(path, self.config, self.context))
+        for name, globs in self.config['bundles'].items():
+            self._add_bundle(name, globs)
+
+    # A bundle takes the assets matching its globs, in the order of the globs and then by path. Template assets are
+    # left out, since their output only exists once they are rendered.
+    def _add_bundle(self, name, globs):
+        src = self.config['source'] / name
+        if src in self.sources:
+            print(f'WARNING: Bundle "{name}" has the same path as a file in your source directory. Skipping it.')
+            return
+        source = self.config['source']
+        assets = [x for x in self.artifacts if isinstance(x, Asset) and not isinstance(x, TemplateAsset)]
+        members = {}
+        for pattern in [globs] if isinstance(globs, str) else globs:
+            regex = compile_glob(pattern)[0]
+            for x in assets:
+                if x.src not in members and regex.fullmatch(x.src.relative_to(source).as_posix()):
+                    members[x.src] = x
+        if not members:
+            print(f'WARNING: Bundle "{name}" does not match any assets.')
+        self.add_artifact(Bundle(src, self.config, self.context, list(members.values())))
+
+    # Artifacts added after the context is built (i.e. already set up) are indexed straight away
+    def add_artifact(self, artifact):
+        self.artifacts.append(artifact)
+        self.sources[artifact.src] = artifact
+        if self.index is not None:
+            self.index.add(artifact)
 
     def _build_context(self):
+        self.artifacts = [x for x in self.artifacts if x.origin is None]
+        self.index = DirectoryIndex(self.config['output'])
+        for artifact in self.artifacts:
+            self.index.add(artifact)
+        self.context['index'] = self.index
+        for artifact in list(self.artifacts):
+            for extra in artifact.expand():
+                extra.setup_context()
+                self.add_artifact(extra)
+        self.pending = list(self.artifacts)
         self.context['artifacts'] = self.artifacts
-        self.context['pages'] = [x for x in self.artifacts if x.dest.suffix == '.html']
-        self.context['stylesheets'] = [x.context['url'] for x in self.artifacts if x.dest.suffix == '.css']
-        self.context['logo'] = self.config['logo']
-        self.context['icon'] = self.config['icon']
-        self.context['favicon'] = self.config['icon']
+        self.context['pages'] = self.index.pages
+        self.context['root_pages'] = self.index.root_pages()
+        self.context['children'] = self.index.children
+        self.context['parent'] = self.index.parent
+        bundles = [x for x in self.artifacts if isinstance(x, Bundle)]
+        bundled = {m.src for x in bundles for m in x.members}
+        self.context['stylesheets'] = [x['url'] for x in self.artifacts if x.dest.suffix == '.css' and x.src not in bundled]
+        self.context['bundles'] = {x.src.relative_to(self.config['source']).as_posix(): x['url'] for x in bundles}
+        self.context['logo'] = self._asset_ref(self.config['logo'])
+        self.context['icon'] = self._asset_ref(self.config['icon'])
+        self.context['favicon'] = self.context['icon']
+        self.context['asset_url'] = self.asset_url
         self.context['home_url'] = self._get_home_url()
-        self.context.update(self.config['context'])
-        
+        self.context['search_url'] = quote(self.config['search_dir']) if self.config['search_index'] else None
+        self.context.maps[-1] = self.config['context']
+        if self.config['fingerprint_assets']:
+            self.config.get_hash_cache().save()
+
+    # Url of the asset at path in the source directory, for templates: {{ asset_url('style.css') }}
+    def asset_url(self, path):
+        artifact = self.sources.get(self.config['source'] / str(path).lstrip('/'))
+        if artifact is None or 'url' not in artifact:
+            print(f'WARNING: asset_url("{path}") does not match a file in your source directory.')
+            return quote(str(path).lstrip('/'))
+        return artifact['url']
+
+    # The logo and icon settings point at source files, which are renamed when assets are fingerprinted
+    def _asset_ref(self, path):
+        if self.config['fingerprint_assets'] and path in self.sources:
+            return self.sources[path]['url']
+        return path
+
+    # Narrow the remaining steps to artifacts whose inputs changed since the last build (and that are in this shard)
+    def _check_manifest(self):
+        artifacts = self.artifacts
+        if self.shard is not None:
+            self._check_site_metadata()
+            source = self.config['source']
+            shard, count = self.shard
+            artifacts = [x for x in artifacts if shard_of(x.src.relative_to(source).as_posix(), count) == shard]
+        site_inputs = self._site_fingerprint()
+        listing = self._listing_fingerprint()
+        full = self.manifest.site != site_inputs
+        # The search index only holds pages indexed while it was turned on, so rebuild everything if it is missing
+        if self.config['search_index'] and not (self.config.get_search_index().output / 'pages.json').is_file():
+            full = True
+        # A page's fingerprint only has the digest of its own layout, not of the files it includes or extends
+        if any(self._template_digest(Path(x)) != digest for x, digest in self.manifest.templates.items()):
+            full = True
+        self.fingerprints = {}
+        self.pending = []
+        for artifact in artifacts:
+            inputs = artifact.fingerprint()
+            self.fingerprints[artifact['src']] = inputs
+            entry = self.manifest.artifacts.get(artifact['src'])
+            artifact.last_output = entry.get('output') if entry else None
+            if full or self.manifest.is_stale(artifact, inputs, listing):
+                self.pending.append(artifact)
+        self.previous_outputs = self.manifest.outputs()
+        self._remove_stale_outputs()
+        self.manifest.site = site_inputs
+        self.manifest.listing = listing
+
+    # Every shard has to build from the same site-wide context. A metadata file passed in is shared by the shards, so reuse it
+    # if it exists and check it still matches. The default one in the cache directory is only this machine's, so rewrite it.
+    def _check_site_metadata(self):
+        current = SiteMetadata(self.metadata.path)
+        current.collect(self)
+        if self.shared_metadata and self.metadata.load():
+            if self.metadata.digest() != current.digest():
+                raise ValueError(f'Site metadata in "{self.metadata.path}" does not match the source files. Build every shard from the same sources, or delete it.')
+        else:
+            current.save()
+            self.metadata = current
+
+    # Site-wide inputs every page may render
+    def _site_fingerprint(self):
+        search_index = self.config.get_search_index() if self.config['search_index'] else None
+        return hash_text(repr([
+            self.context['stylesheets'],
+            self.context['logo'],
+            self.context['icon'],
+            self.context['home_url'],
+            self.config['context'],
+            self.config['fingerprint_assets'] and [x['url'] for x in self.artifacts if x.hashed_name],
+            search_index and [search_index.output.as_posix(), search_index.prefix, SEARCH_VERSION]
+        ]))
+
+    # The listing templates get from pages, root_pages, children() and parent(). Only pages whose last render looked
+    # one of them up are rebuilt when it changes; the others depend on the listing only through their own subpages.
+    def _listing_fingerprint(self):
+        return hash_text(repr([[x['url'], x['title']] for x in self.index.pages]))
+
+    def _remove_stale_outputs(self):
+        dests = {x.dest.as_posix() for x in self.artifacts}
+        for entry in self.manifest.artifacts.values():
+            if entry['dest'] in dests:
+                continue
+            dest = Path(entry['dest'])
+            dest.unlink(missing_ok=True)
+            for parent in dest.parents:
+                if parent == self.config['output'] or self.config['output'] not in parent.parents:
+                    break
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+
+    def _update_manifest(self):
+        built = {x['src'] for x in self.pending}
+        artifacts = {}
+        for artifact in self.artifacts:
+            src = artifact['src']
+            if src in built:
+                entry = dict(self.fingerprints[src])
+                entry['dest'] = artifact.dest.as_posix()
+                if artifact.get('reads_listing'):
+                    entry['reads_listing'] = True
+                if 'output_hash' in artifact:
+                    entry['output'] = artifact['output_hash']
+                else:
+                    entry['output'] = hash_file(artifact.dest) if artifact.dest.is_file() else None
+                artifact.last_output = entry['output']
+                artifacts[src] = entry
+            elif src in self.manifest.artifacts:
+                artifacts[src] = self.manifest.artifacts[src]
+        self.manifest.artifacts = artifacts
+        self._record_templates()
+        self.manifest.save()
+        self._write_changes()
+
+    # Every template file loaded so far, and those of earlier builds that weren't loaded this time since their pages didn't change
+    def _record_templates(self):
+        paths = set(self.manifest.templates)
+        if self.config.templates is not None:
+            paths.update(x.as_posix() for x in self.config.templates.dependencies())
+        digests = {x: self._template_digest(Path(x)) for x in sorted(paths)}
+        self.manifest.templates = {k: v for k, v in digests.items() if v is not None}
+
+    def _template_digest(self, path):
+        return hash_file(path) if path.is_file() else None
+
+    # Output files added, modified and deleted since the last build, relative to the output directory, for deploy tools
+    def _write_changes(self):
+        before = self.previous_outputs
+        after = self.manifest.outputs()
+        output = self.config['output']
+
+        def relative(dests):
+            return sorted(Path(x).relative_to(output).as_posix() for x in dests)
+
+        self.changes = {
+            'added': relative(after.keys() - before.keys()),
+            'modified': relative(x for x in after.keys() & before.keys() if after[x] != before[x]),
+            'deleted': relative(before.keys() - after.keys())
+        }
+        self.changes_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.changes_path, 'w+') as f:
+            json.dump(self.changes, f, indent=1)
+
+    def _write_search_index(self):
+        if not self.config['search_index']:
+            return
+        if self.shard is not None:
+            print('WARNING: Sharded builds do not write a search index.')
+            return
+        search_index = self.config.get_search_index()
+        search_index.update({x['src']: [x['url'], x['title']] for x in self.artifacts if isinstance(x, Page) and not isinstance(x, NavPage)})
+        for path in search_index.deleted:
+            self.manifest.files.pop(path, None)
+        self.manifest.files.update(search_index.written)
+
+    # Sharded builds leave the home redirect to merge()
     def _write_artifact(self):
         self.config['output'].mkdir(exist_ok=True, parents=True)
-        if self.context['home_url']:    
-            with open(self.config['output'] / 'index.html', 'w+') as f:
-                f.write(HOME_REDIRECT_HTML.format(home_url=self.context['home_url']))
+        output_dirs = self.config.get_output_dirs()
+        output_dirs.reset()
+        output_dirs.make_all(x.dest.parent for x in self.pending if x.dest is not None)
+        dest = self.config['output'] / 'index.html'
+        previous = self.manifest.files.pop(dest.as_posix(), None)
+        if self.context['home_url'] and self.shard is None:
+            writer = AtomicFile(dest, previous)
+            with writer as f:
+                f.write(self.home_redirect())
+            self.manifest.files[dest.as_posix()] = writer.digest
+        elif previous and dest not in self.index.by_dest:
+            dest.unlink(missing_ok=True)
+
+    def home_redirect(self):
+        return HOME_REDIRECT_HTML.format(home_url=self.context['home_url'])
 
     def _get_home_url(self):    
-        if [x for x in self.context['pages'] if x.dest == self.config['output'] / 'index.html']:
+        if self.config['output'] / 'index.html' in self.index.by_dest:
             return None
         else:
             home_url = None
             
-            root_pages = [x for x in self.context['pages'] if x.dest.parent == self.config['output']]
+            root_pages = self.index.root_pages()
 
             if not root_pages:
                 root_pages = self.context['pages']
@@ -99,29 +369,365 @@ class Site:
 
             return home_url
             
-    def build(self):
-        for step in self.build_steps:
+    # A streaming build runs the stream steps one artifact at a time and releases each artifact's content once it is
+    # written, so memory use grows with the number of artifacts rather than the size of their content
+    # A sharded build, with shard=(K, N), only builds the artifacts assigned to shard K of N, for combining with merge()
+    # Writes the output changes to changes (a path), by default changes.json in the cache directory
+    def build(self, full=False, jobs=1, stream=False, shard=None, metadata=None, changes=None):
+        import multiprocessing
+        if jobs < 1:
+            jobs = os.cpu_count() or 1
+        if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print('WARNING: Parallel builds need the "fork" start method, which this platform does not support. Building serially.')
+            jobs = 1
+
+        self.config.refresh()
+        with self.config.get_build_lock():
+            # A full build still loads the manifest, to know which outputs changed and which are stale
+            self.manifest = Manifest(self.config['cache'] / 'manifest')
+            self.manifest.load()
+            if full:
+                self.manifest.site = None
+            self.changes_path = Path(changes) if changes else self.config['cache'] / 'changes.json'
+            self.shard = shard
+            self.metadata = SiteMetadata(metadata or self.config['cache'] / 'site-metadata.json') if shard else None
+            self.shared_metadata = metadata is not None
+            self.pending = list(self.artifacts)
+            self._run_steps(self.build_steps, jobs, stream)
+            self.config.get_conversion_cache().prune()
+            if shard:
+                self._write_shard_file()
+            self._build_report()
+
+    def _write_shard_file(self):
+        with open(self.config['output'] / SHARD_FILE, 'w+') as f:
+            json.dump({
+                'shard': self.shard[0],
+                'count': self.shard[1],
+                'metadata': self.metadata.digest(),
+                'home_url': self.metadata.home_url
+            }, f)
+
+    # Make path a link to a snapshot of the output, hardlinked so unchanged files keep their inode and mtime, and
+    # swap it in atomically, so whatever serves path goes from the old site to the new one at once
+    def publish(self, path):
+        path = Path(path).absolute()
+        if path.exists() and not path.is_symlink():
+            raise ValueError(f'"{path}" exists and is not a link made by publishing. Move it out of the way first.')
+        output = self.config['output']
+        stage = path.with_name(f'.{path.name}.{time.time_ns()}')
+        stage.mkdir(parents=True)
+        for root, _, files in os.walk(output):
+            for name in files:
+                src = Path(root) / name
+                sync_file(src, stage / src.relative_to(output), 'hardlink')
+
+        previous = path.resolve() if path.is_symlink() else None
+        link = path.with_name(f'.{path.name}.link')
+        link.unlink(missing_ok=True)
+        os.symlink(stage.name, link)
+        os.replace(link, path)
+        if previous is not None and previous.name.startswith(f'.{path.name}.'):
+            shutil.rmtree(previous, ignore_errors=True)
+
+    # Combine the output directories of every shard of a sharded build into the output directory
+    def merge(self, dirs):
+        shards = {}
+        for path in dirs:
+            try:
+                with open(Path(path) / SHARD_FILE, 'r') as f:
+                    shards[Path(path).resolve()] = json.load(f)
+            except (OSError, ValueError):
+                raise ValueError(f'"{path}" is not the output of a sharded build.')
+        infos = list(shards.values())
+        if len({(x['count'], x['metadata']) for x in infos}) > 1:
+            raise ValueError('Shards were built from different sources or with different shard counts.')
+        missing = set(range(1, infos[0]['count'] + 1)) - {x['shard'] for x in infos}
+        if missing:
+            print(f"WARNING: Missing shards {', '.join(map(str, sorted(missing)))} of {infos[0]['count']}. Their pages will not be in the output.")
+
+        output = self.config['output']
+        for path in shards:
+            for root, _, files in os.walk(path):
+                for name in files:
+                    src = Path(root) / name
+                    if src == path / SHARD_FILE:
+                        continue
+                    sync_file(src, output / src.relative_to(path), self.config['copy_mode'])
+
+        output.mkdir(parents=True, exist_ok=True)
+        self.context['home_url'] = infos[0]['home_url']
+        if self.context['home_url']:
+            with open(output / 'index.html', 'w+') as f:
+                f.write(self.home_redirect())
+
+    def _build_report(self):
+        self.report = {
+            'artifacts': len(self.artifacts),
+            'built': len(self.pending),
+            'bytes_copied': sum(x.get('copied_bytes', 0) for x in self.pending),
+            'bytes_skipped': sum(x.get('skipped_bytes', 0) for x in self.pending),
+            'changes': {k: len(v) for k, v in self.changes.items()}
+        }
+
+    # Run only the steps that build the site-wide context (dest, url, title, directory index), without rendering anything
+    def prepare(self):
+        self.config.refresh()
+        self.pending = list(self.artifacts)
+        self._run_steps(self.context_steps)
+
+    # Timing hooks are called with a record (see s4_gen.profile.measure) for every site step and every artifact step
+    def add_timing_hook(self, hook):
+        self.timing_hooks.append(hook)
+
+    def _emit_timing(self, record):
+        with self.timing_lock:
+            for hook in self.timing_hooks:
+                hook(record)
+
+    def _call(self, step, artifact, method, cpu_clock=time.thread_time):
+        if not self.timing_hooks:
+            return method()
+        self._emit_timing(measure(method, step, artifact.src.as_posix() if artifact is not None else None, cpu_clock))
+
+    def _run_steps(self, steps, jobs=1, stream=False):
+        streamed = [x for x in steps if x in self.stream_steps] if stream else []
+        for step in steps:
+            if step not in streamed:
+                self._call(step, None, lambda: self._run_step(step, jobs), time.process_time)
+            elif step == streamed[0]:
+                self._call('stream', None, lambda: self._run_stream(streamed, jobs), time.process_time)
+
+    def _run_step(self, step, jobs):
         
+        site_method = getattr(self, '_' + step, None)
+        if callable(site_method):
+            site_method()
+
+        if jobs > 1 and step in self.parallel_steps and len(self.pending) > 1:
+            self._run_parallel([step], jobs)
+            return
+
+        errors = {}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(self.config['io_threads']) as pool:
+            for i, artifact in enumerate(self.pending):
+                if not callable(getattr(artifact, step, None)):
+                    continue
+                if step in self.read_steps or step in self.write_steps or step in artifact.threaded_steps:
+                    pool.submit(self._run_artifact, i, artifact, [step], errors)
+                elif not self._run_artifact(i, artifact, [step], errors):
+                    break
+        self._raise_first(errors)
+
+    # Run steps for the artifact at index of pending, keeping the error instead of raising it. Returns whether it succeeded.
+    def _run_artifact(self, index, artifact, steps, errors, release=False):
+        try:
+            for step in steps:
+                method = getattr(artifact, step, None)
+                if callable(method):
+                    self._call(step, artifact, method)
+        except Exception as e:
+            errors[index] = e
+            return False
+        if release:
+            artifact.release()
+        return True
+
+    # Artifacts are read and written on several threads, so errors are collected and the one of the first artifact that
+    # failed is raised, making a build fail the same way every time
+    def _raise_first(self, errors):
+        if errors:
+            raise errors[min(errors)]
+
+    # Run every step for one artifact after another, then drop its content. Reading and writing are pipelined: while an
+    # artifact is converted and rendered, the sources of the next read_ahead are read and earlier ones are written.
+    def _run_stream(self, steps, jobs):
+        for step in steps:
             site_method = getattr(self, '_' + step, None)
             if callable(site_method):
                 site_method()
-                
-            for artifact in self.artifacts:
-                method = getattr(artifact, step, None)
-                if callable(method):
-                    method()
-                    
-    def serve(self):
+
+        if jobs > 1 and len(self.pending) > 1:
+            self._run_parallel(steps, jobs, release=True)
+            return
+
+        # Artifacts whose stream steps all wait on I/O (e.g. assets) still go to the thread pool
+        def is_threaded(artifact):
+            return all(step in artifact.threaded_steps for step in steps if callable(getattr(artifact, step, None)))
+
+        # Stream steps start with reading and end with writing
+        read_steps = [x for x in steps if x in self.read_steps]
+        write_steps = [x for x in steps if x in self.write_steps]
+        process_steps = [x for x in steps if x not in read_steps and x not in write_steps]
+        depth = max(1, self.config['read_ahead'])
+
+        errors = {}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(self.config['io_threads']) as pool, ThreadPoolExecutor(self.config['io_threads']) as io:
+            serial = []
+            for i, artifact in enumerate(self.pending):
+                if is_threaded(artifact):
+                    pool.submit(self._run_artifact, i, artifact, steps, errors, True)
+                else:
+                    serial.append((i, artifact))
+
+            reads = {}
+            writes = deque()
+            ahead = 0
+            for n, (i, artifact) in enumerate(serial):
+                while ahead < len(serial) and ahead <= n + depth:
+                    j, next_artifact = serial[ahead]
+                    reads[j] = io.submit(self._run_artifact, j, next_artifact, read_steps, errors)
+                    ahead += 1
+                if not reads.pop(i).result() or not self._run_artifact(i, artifact, process_steps, errors):
+                    break
+                writes.append(io.submit(self._run_artifact, i, artifact, write_steps, errors, True))
+                # Bound how much rendered content waits to be written
+                while len(writes) > depth:
+                    writes.popleft().result()
+        self._raise_first(errors)
+
+    # Run artifact steps across worker processes, then merge the fields each artifact produced back in
+    def _run_parallel(self, steps, jobs, release=False):
+        import multiprocessing
+        global _worker_site
+        _worker_site = self
+        jobs_list = [(steps, i, release) for i in range(len(self.pending))]
+        try:
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                results = pool.map(_run_artifact_steps, jobs_list, chunksize=max(1, len(jobs_list) // (jobs * 4)))
+        finally:
+            _worker_site = None
+        for artifact, (result, records) in zip(self.pending, results):
+            artifact.update(result)
+            for record in records:
+                self._emit_timing(record)
+
+    # Re-discover the source files, e.g. after files were added or removed
+    def reload(self):
+        self.artifacts = []
+        self.sources = {}
+        self.index = None
+        self._load_files()
+
+    # Re-run the artifact steps for just these artifacts, keeping the site-wide context from the last build
+    def rebuild(self, artifacts):
+        with self.config.get_build_lock():
+            self.pending = list(artifacts)
+            self.config.get_output_dirs().reset()
+            self.previous_outputs = self.manifest.outputs()
+            for step in self.build_steps:
+                for artifact in self.pending:
+                    method = getattr(artifact, step, None)
+                    if callable(method):
+                        method()
+            for artifact in self.pending:
+                self.fingerprints[artifact['src']] = artifact.fingerprint()
+            self._write_search_index()
+            self._update_manifest()
+            self._build_report()
+
+    # Work out which artifacts changed source files affect. Returns None if the whole site has to be rebuilt.
+    def affected_artifacts(self, added, modified, removed):
+        conf_path = Path(self.config.path).resolve() if self.config.path else None
+        if added or removed or conf_path in modified:
+            self.reload()
+            return None
+        # A fingerprinted asset that changed gets a new url, which every page may link to
+        if self.config['fingerprint_assets'] and any(self.sources[x].hashed_name for x in modified if x in self.sources):
+            return None
+        dependencies = self.config.get_templates().dependencies()
+        if any(x in dependencies for x in modified):
+            self.config.invalidate()
+            return None
+        artifacts = [self.sources[x] for x in modified if x in self.sources]
+        # Bundles are rebuilt along with their members
+        changed = {x.src for x in artifacts}
+        artifacts.extend(x for x in self.artifacts if isinstance(x, Bundle) and any(m.src in changed for m in x.members))
+        return artifacts
+
+    # Bring the output up to date with changed source files, rebuilding as little as possible
+    def update(self, added, modified, removed):
+        artifacts = self.affected_artifacts(added, modified, removed)
+        if artifacts is None:
+            self.build()
+        else:
+            self.rebuild(artifacts)
+
+    # Watches the source tree the way it is walked, plus the config and template files wherever they are
+    def watcher(self):
+        from s4_gen.watch import Watcher
+        return Watcher(self.config['source'], [self.config['output'], self.config['cache']], self.config['ignore'], self.watched_files)
+
+    def watched_files(self):
+        files = set(self.config.templates.dependencies()) if self.config.templates is not None else set()
+        if self.config.path:
+            files.add(Path(self.config.path).resolve())
+        return files
+
+    # Poll the source tree and pass every batch of changes to update(added, modified, removed)
+    def watch(self, update, interval=0.2):
+        watcher = self.watcher()
+        while True:
+            time.sleep(interval)
+            added, modified, removed = watcher.poll()
+            if not (added or modified or removed):
+                continue
+            try:
+                update(added, modified, removed)
+            except Exception as e:
+                print(f'ERROR: Rebuild failed: {e}')
+
+    def serve(self, watch=False, memory=False):
+        import http.server
+        import webbrowser
+        from s4_gen.server import DevServer
+        from s4_gen.watch import LiveReload, RELOAD_PATH, inject_reload_script
+
+        if memory:
+            DevServer(self, watch).serve_forever()
+            return
+
+        output = self.config['output']
+        reloader = LiveReload() if watch else None
     
         class Handler(http.server.SimpleHTTPRequestHandler):
             def __init__(self, *args, **kwargs):
-                super().__init__(*args, directory=self.config['output'], **kwargs)
+                super().__init__(*args, directory=output, **kwargs)
+
+            def do_GET(self):
+                if reloader is None:
+                    return super().do_GET()
+                if self.path == RELOAD_PATH:
+                    return reloader.stream(self)
+                path = Path(self.translate_path(self.path))
+                if path.is_dir():
+                    path = path / 'index.html'
+                if path.suffix != '.html' or not path.is_file():
+                    return super().do_GET()
+                with open(path, 'r') as f:
+                    body = inject_reload_script(f.read()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+        def update(*changes):
+            self.update(*changes)
+            reloader.notify()
+
+        if watch:
+            threading.Thread(target=self.watch, args=(update,), daemon=True).start()
 
-        server = http.server.HTTPServer(('localhost', 8000), Handler)
+        server = http.server.ThreadingHTTPServer(('localhost', 8000), Handler)
         webbrowser.open('localhost:8000/')
         server.serve_forever()
 
     def clean(self):
 
-        if self.config['output'].exists():
-            shutil.rmtree(str(self.config['output']))
+        with self.config.get_build_lock():
+            if self.config['output'].exists():
+                shutil.rmtree(str(self.config['output']))
@@ -0,0 +1,78 @@
+import os
+import shutil
+
+COPY_MODES = ['copy', 'hardlink', 'reflink', 'symlink']
+
+# Linux ioctl for cloning a file's extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Modes that failed on this machine; later files go straight to a plain copy
+_unsupported = set()
+
+def _reflink(src, dest):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def _copy(src, dest):
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                return
+        except OSError:
+            pass
+    # Uses sendfile (Linux) or fcopyfile (macOS) where available
+    shutil.copyfile(src, dest)
+
+def is_synced(src, dest, mode):
+    try:
+        dest_stat = os.lstat(dest)
+        src_stat = os.stat(src)
+    except FileNotFoundError:
+        return False
+    if mode == 'symlink':
+        return os.path.islink(dest) and os.readlink(dest) == str(src)
+    if mode == 'hardlink':
+        return os.path.samestat(src_stat, dest_stat)
+    return (not os.path.islink(dest)
+            and not os.path.samestat(src_stat, dest_stat)
+            and dest_stat.st_size == src_stat.st_size
+            and dest_stat.st_mtime_ns == src_stat.st_mtime_ns)
+
+# Make dest a copy (or link) of src unless it already is one. Returns (bytes copied, bytes skipped).
+def sync_file(src, dest, mode='copy'):
+    if mode in _unsupported:
+        mode = 'copy'
+    size = os.stat(src).st_size
+    if is_synced(src, dest, mode):
+        return 0, size
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # Never write through an old link into the source file
+    dest.unlink(missing_ok=True)
+
+    if mode != 'copy':
+        try:
+            if mode == 'hardlink':
+                os.link(src, dest)
+            elif mode == 'symlink':
+                os.symlink(src, dest)
+            elif mode == 'reflink':
+                _reflink(src, dest)
+                shutil.copystat(src, dest)
+            return size, 0
+        except (OSError, ImportError) as e:
+            print(f'WARNING: copy_mode "{mode}" is not supported here ({e}). Copying files instead.')
+            _unsupported.add(mode)
+            dest.unlink(missing_ok=True)
+
+    _copy(src, dest)
+    shutil.copystat(src, dest)
+    return size, 0
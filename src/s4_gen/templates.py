@@ -0,0 +1,97 @@
+from collections import ChainMap
+from pathlib import Path
+
+from jinja2 import Environment, BaseLoader, FileSystemLoader, FileSystemBytecodeCache
+from jinja2.bccache import Bucket
+from jinja2.environment import TemplateStream
+
+from s4_gen.utils import hash_text
+
+TEMPLATE_CACHE_SIZE = 400
+
+# Serves in-memory template sources registered under their digest, and files under the source directory otherwise
+class SourceLoader(BaseLoader):
+
+    def __init__(self, source):
+        self.strings = {}
+        self.files = FileSystemLoader(source)
+        self.dependencies = set()
+
+    def get_source(self, environment, template):
+        if template in self.strings:
+            return self.strings[template], None, lambda: True
+        source, filename, uptodate = self.files.get_source(environment, template)
+        self.dependencies.add(Path(filename).resolve())
+        return source, filename, uptodate
+
+# Keeps compiled layouts and includes on disk, but not page bodies: every edit to a page would leave another file behind
+class LayoutBytecodeCache(FileSystemBytecodeCache):
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.uncached = set()
+
+    def get_bucket(self, environment, name, filename, source):
+        if name not in self.uncached:
+            return super().get_bucket(environment, name, filename, source)
+        bucket = Bucket(environment, self.get_cache_key(name, filename), self.get_source_checksum(source))
+        bucket.uncached = True
+        return bucket
+
+    def set_bucket(self, bucket):
+        if not getattr(bucket, 'uncached', False):
+            super().set_bucket(bucket)
+
+# The Jinja environment shared by every template of a site
+class Templates:
+
+    def __init__(self, source, cache):
+        cache = cache / 'jinja'
+        cache.mkdir(parents=True, exist_ok=True)
+        self.loader = SourceLoader(source)
+        self.bytecode_cache = LayoutBytecodeCache(str(cache))
+        self.environment = Environment(
+            loader=self.loader,
+            bytecode_cache=self.bytecode_cache,
+            cache_size=TEMPLATE_CACHE_SIZE
+        )
+
+    # Compiled templates are cached by the environment under the digest of their source,
+    # so identical page bodies and layouts are only compiled once. Page bodies pass bytecode=False to stay out of the disk cache.
+    def from_string(self, source, bytecode=True):
+        digest = hash_text(source)
+        name = 'digest:' + digest
+        self.loader.strings[name] = source
+        if not bytecode:
+            self.bytecode_cache.uncached.add(name)
+        try:
+            template = self.environment.get_template(name)
+        finally:
+            self.loader.strings.pop(name, None)
+            self.bytecode_cache.uncached.discard(name)
+        template.digest = digest
+        return template
+
+    # Files any template was read from, so changes to them can be traced back to the pages using them
+    def dependencies(self):
+        return self.loader.dependencies
+
+    def from_file(self, path):
+        self.loader.dependencies.add(Path(path).resolve())
+        with open(path, 'r') as f:
+            return self.from_string(f.read())
+
+    # Template.render and Template.generate copy their variables into a new dict. These use context as is,
+    # layered over the template's globals, so a render costs the same however many variables the site has.
+    def generate(self, template, context):
+        ctx = template.new_context(ChainMap(context, template.globals), shared=True)
+        try:
+            yield from template.root_render_func(ctx)
+        except Exception:
+            yield self.environment.handle_exception()
+
+    def render(self, template, context):
+        return self.environment.concat(self.generate(template, context))
+
+    def stream(self, template, context):
+        return TemplateStream(self.generate(template, context))
@@ -1,5 +1,13 @@
 from pathlib import Path
+import hashlib
+import os
 import re
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # If the config specifies it, prettify the urls so they use only lowercase alphanumerics with hyphens as seperators
 def prettify_path(path):
@@ -16,3 +24,118 @@ def filename_to_title(filename):
     name = name.strip()
     name = name.title()
     return name
+
+# Hex digest of a string, used to fingerprint sources and templates
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Hex digest of a file's bytes, read in chunks so large assets are not loaded at once
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Text file that hashes what is written to it on the way through, so the digest doesn't need the file read back
+class HashingWriter:
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+# Writes to a temporary file next to path and moves it into place on close, so readers never see a partial file.
+# If the content hashes to previous (a hash_file digest of what path last held), path is left untouched instead.
+class AtomicFile:
+
+    def __init__(self, path, previous=None, buffering=1 << 16):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        self.previous = previous
+        self.buffering = buffering
+        self.file = None
+        self.writer = None
+        self.digest = None
+        self.changed = None
+
+    def __enter__(self):
+        self.file = open(self.tmp, 'wb', buffering=self.buffering)
+        self.writer = HashingWriter(self.file)
+        return self.writer
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is not None:
+            self.tmp.unlink(missing_ok=True)
+            return False
+        self.digest = self.writer.hash.hexdigest()
+        self.changed = self.digest != self.previous or not self.path.is_file()
+        if self.changed:
+            os.replace(self.tmp, self.path)
+        else:
+            self.tmp.unlink()
+        return False
+
+# Directories of output files, each created once however many files are written to it and from however many threads
+class OutputDirs:
+
+    def __init__(self):
+        self.made = set()
+        self.lock = threading.Lock()
+
+    def make(self, path):
+        if path in self.made:
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            self.made.add(path)
+
+    # Create the directories for a batch of files up front, one mkdir per directory
+    def make_all(self, paths):
+        for path in sorted(set(paths)):
+            self.make(path)
+
+    # Forget what was created, e.g. since the output directory may have been removed between builds
+    def reset(self):
+        with self.lock:
+            self.made = set()
+
+# Exclusive lock on a file in the cache directory, so two processes (e.g. a build daemon and a build without it) never
+# write the same output and cache at once. Taking it again in the process holding it just nests.
+class BuildLock:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            file = open(self.path, 'a')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    file.close()
+                    raise ValueError(f'Another build of this site is running (it holds "{self.path}"). Wait for it to finish or stop it.')
+            self.file = file
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            # Closing the file releases the lock
+            self.file.close()
+            self.file = None
+        return False
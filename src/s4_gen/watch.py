@@ -0,0 +1,100 @@
+import os
+import threading
+from pathlib import Path
+
+from s4_gen.discover import compile_glob
+
+RELOAD_PATH = '/__s4/reload'
+RELOAD_SCRIPT = f"<script>new EventSource('{RELOAD_PATH}').onmessage = () => location.reload();</script>"
+
+# Polls a directory tree and reports which files were added, modified or removed since the last poll. Paths matching
+# ignore (globs relative to root, as in the ignore setting) are skipped like the site skips them, and the files returned by
+# extra are watched wherever they are.
+class Watcher:
+
+    def __init__(self, root, exclude=[], ignore=[], extra=None):
+        self.root = Path(root)
+        self.exclude = {Path(x) for x in exclude}
+        self.ignore = [compile_glob(x)[0] for x in ignore]
+        self.extra = extra
+        self.files = self._scan()
+
+    def _scan(self):
+        files = {}
+        dirs = [(self.root, '')]
+        while dirs:
+            path, rel = dirs.pop()
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                child = Path(entry.path)
+                child_rel = rel + '/' + entry.name if rel else entry.name
+                if child in self.exclude or any(x.fullmatch(child_rel) for x in self.ignore):
+                    continue
+                try:
+                    if entry.is_dir():
+                        dirs.append((child, child_rel))
+                    else:
+                        stat = entry.stat()
+                        files[child] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue
+        for path in self.extra() if self.extra else []:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[Path(path)] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self):
+        files = self._scan()
+        added = files.keys() - self.files.keys()
+        removed = self.files.keys() - files.keys()
+        modified = {x for x in files.keys() & self.files.keys() if files[x] != self.files[x]}
+        self.files = files
+        return added, modified, removed
+
+# Lets live reload connections wait until the site has been rebuilt
+class LiveReload:
+
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    # Hold a request open as a server-sent event stream, sending an event after every rebuild
+    def stream(self, handler):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+        version = self.version
+        try:
+            while True:
+                new_version = self.wait(version, 15)
+                if new_version != version:
+                    handler.wfile.write(b'data: reload\n\n')
+                    version = new_version
+                else:
+                    handler.wfile.write(b': keep-alive\n\n')
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def inject_reload_script(html):
+    index = html.rfind('</body>')
+    if index == -1:
+        return html + RELOAD_SCRIPT
+    return html[:index] + RELOAD_SCRIPT + html[index:]
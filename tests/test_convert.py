@@ -0,0 +1,25 @@
+from s4_gen.convert import txt2html
+
+def test_txt_paragraphs():
+    assert txt2html('one\ntwo\n\nthree') == '<p>\none\ntwo\n</p>\n<p>\nthree\n</p>'
+
+def test_txt_whitespace_only_paragraphs():
+    assert txt2html('one\n\n  \n\t\n\ntwo') == '<p>\none\n</p>\n<p>\ntwo\n</p>'
+    assert txt2html('\n\n  \n\none\n\n \n') == '<p>\none\n</p>'
+
+def test_txt_escaping():
+    assert txt2html('a < b & c > d') == '<p>\na &lt; b &amp; c &gt; d\n</p>'
+
+def test_txt_repeated_url():
+    assert txt2html('see http://a.com and http://a.com') == '<p>\nsee <a href="http://a.com">http://a.com</a> and <a href="http://a.com">http://a.com</a>\n</p>'
+
+def test_txt_url_trailing_punctuation():
+    assert txt2html('go to http://a.com/x.') == '<p>\ngo to <a href="http://a.com/x">http://a.com/x</a>.\n</p>'
+    assert txt2html('(see http://a.com/x)') == '<p>\n(see <a href="http://a.com/x">http://a.com/x</a>)\n</p>'
+    assert txt2html('(http://a.com/x_(y)).') == '<p>\n(<a href="http://a.com/x_(y)">http://a.com/x_(y)</a>).\n</p>'
+
+def test_txt_url_ampersand():
+    assert txt2html('http://a.com/?a=1&b=2') == '<p>\n<a href="http://a.com/?a=1&amp;b=2">http://a.com/?a=1&amp;b=2</a>\n</p>'
+
+def test_txt_url_ends_at_markup():
+    assert txt2html('<http://a.com>') == '<p>\n&lt;<a href="http://a.com">http://a.com</a>&gt;\n</p>'
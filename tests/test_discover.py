@@ -0,0 +1,43 @@
+from s4_gen.artifact import Artifact
+from s4_gen.discover import compile_glob, FileWalker
+
+def matches(pattern, path):
+    return compile_glob(pattern)[0].fullmatch(path) is not None
+
+def test_glob_wildcards():
+    assert matches('*.md', 'a.md')
+    assert not matches('*.md', 'a/b.md')
+    assert matches('**/*.md', 'a.md')
+    assert matches('**/*.md', 'a/b/c.md')
+    assert matches('./a/?.md', 'a/b.md')
+
+def test_glob_classes():
+    assert matches('[ab].md', 'b.md')
+    assert not matches('[ab].md', 'c.md')
+    assert matches('[!x]*.md', 'y.md')
+    assert not matches('[!x]*.md', 'x.md')
+    assert matches('[!a-c].md', 'd.md')
+    assert not matches('[!a-c].md', 'b.md')
+    # Unclosed brackets are literal
+    assert matches('[a.md', '[a.md')
+
+def test_glob_trailing_double_star_is_directory_only():
+    assert compile_glob('a/**')[1]
+    assert not compile_glob('a/**/*')[1]
+    assert matches('a/**', 'a')
+    assert matches('a/**', 'a/b/c')
+    assert not matches('a/**', 'ab')
+
+def test_walker_trailing_double_star(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'c.md').write_text('')
+    (tmp_path / 'a' / 'd.md').write_text('')
+    walker = FileWalker(tmp_path, [(['a/**'], [Artifact])])
+    assert [x.relative_to(tmp_path).as_posix() for x, _ in walker.walk()] == ['a', 'a/b']
+
+def test_walker_ignore_prunes_directories(tmp_path):
+    (tmp_path / 'node_modules' / 'x').mkdir(parents=True)
+    (tmp_path / 'node_modules' / 'x' / 'a.md').write_text('')
+    (tmp_path / 'b.md').write_text('')
+    walker = FileWalker(tmp_path, [(['**/*.md'], [Artifact])], ignore=['node_modules'])
+    assert [x.relative_to(tmp_path).as_posix() for x, _ in walker.walk()] == ['b.md']
@@ -0,0 +1,31 @@
+from s4_gen.minify import minify_css, minify_js
+
+def test_css_whitespace():
+    assert minify_css('a > b {\n  color: red;\n  margin: 0 auto;\n}\n') == 'a>b{color:red;margin:0 auto}'
+
+def test_css_semicolon_before_brace():
+    assert minify_css('a{color:red;}') == 'a{color:red}'
+    assert minify_css('a { color: red; }') == 'a{color:red}'
+    assert minify_css('a { color: red ; }') == 'a{color:red}'
+    assert minify_css('a { color: red;; }') == 'a{color:red}'
+    assert minify_css('a { color: red;\n}\nb { color: blue; }') == 'a{color:red}b{color:blue}'
+
+def test_css_lone_semicolon():
+    assert minify_css('; }') == '}'
+    assert minify_css('a { ; }') == 'a{}'
+
+def test_css_comments():
+    assert minify_css('/* header */\na { color: red; /* why */ }') == 'a{color:red}'
+    assert minify_css('a { color: red; } /* trailing */') == 'a{color:red}'
+    assert minify_css('a/**/b { }') == 'a b{}'
+
+def test_css_strings():
+    assert minify_css('a::after { content: " ;} "; }') == 'a::after{content:" ;} "}'
+    assert minify_css("a { font-family: 'Open  Sans', serif; }") == "a{font-family:'Open  Sans',serif}"
+    assert minify_css('a { content: "/* not a comment */"; }') == 'a{content:"/* not a comment */"}'
+
+def test_js_comments_and_strings():
+    assert minify_js('// note\nvar a = "x  // y";  /* c */\n\n  f(a);\n') == 'var a = "x  // y";\nf(a);'
+
+def test_js_regex_and_division():
+    assert minify_js('var r = /a\\/b/g;\nvar d = x / 2;') == 'var r = /a\\/b/g;\nvar d = x / 2;'